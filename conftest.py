@@ -1 +1,9 @@
+import sys
+
 pytest_plugins = ["tests.helper"]
+
+# The asyncio API requires Python 3.7 or greater, and its tests don't parse
+# on earlier versions
+collect_ignore = []
+if sys.version_info < (3, 7):
+    collect_ignore.append("tests/test_aio.py")
@@ -1,9 +1,14 @@
 from __future__ import division
 
-from io import BytesIO
+from collections import namedtuple, OrderedDict
+import io
+import mmap
+import struct
 import sys
 
-from PIL import ExifTags, Image, ImageFile
+from PIL import Image, ImageFile
+
+from pillow_avif import _isobmff
 
 try:
     from pillow_avif import _avif
@@ -18,11 +23,50 @@ DECODE_CODEC_CHOICE = "auto"
 CHROMA_UPSAMPLING = "auto"
 # Decoding is only affected by this for libavif **0.8.4** or greater.
 DEFAULT_MAX_THREADS = 0
+# Maximum number of bytes of decoded frames to keep per animated image, so
+# that seeking back to a recently loaded frame doesn't decode it again. The
+# default of 0 disables the cache.
+FRAME_CACHE_SIZE = 0
+# Skip reading the EXIF, XMP or ICC metadata, or the alpha channel, when
+# decoding. Ignoring EXIF and XMP only saves copying the metadata out of the
+# file for libavif **0.9.0** or greater. The alpha plane is still decoded by
+# libavif, but isn't converted and the image mode has no alpha channel.
+IGNORE_EXIF = False
+IGNORE_XMP = False
+IGNORE_ICC = False
+IGNORE_ALPHA = False
+# Which images to decode from files with both a still image and an image
+# sequence: "auto" (the sequence, if there is one), "primary" (the still
+# image) or "tracks" (the sequence).
+DECODE_SOURCE = "auto"
+# If True and DECODE_SOURCE is "auto", a call to draft() before loading the
+# first frame of a sequence, as done by Image.thumbnail(), switches to the
+# still image, if the file has one of the same size. The image then has a
+# single frame, and the still image's metadata.
+DRAFT_PRIMARY_ITEM = False
+# Limits on the number of pixels, the width or height, and the number of
+# frames of an image, which are checked when the file is parsed, before any
+# memory is allocated for pixels. Files over the limits fail to open. With a
+# size limit of None, Image.open() leaves decompression bombs to Pillow, which
+# raises DecompressionBombError, and a limit of 0 is libavif's default. The
+# size and frame count limits require libavif **0.9.3** or greater, and the
+# dimension limit **1.0.0**.
+DECODE_IMAGE_SIZE_LIMIT = None
+DECODE_IMAGE_DIMENSION_LIMIT = 0
+DECODE_IMAGE_COUNT_LIMIT = 0
+
+_ORIENTATION_TAG = 0x0112
+
+# Unspecified, BT.470BG and BT.601, which libavif all decodes as BT.601, the
+# matrix used by Pillow's YCbCr mode
+_YCBCR_MATRIX_COEFFICIENTS = (2, 5, 6)
 
 if sys.version_info[0] == 2:
     text_type = unicode  # noqa
+    _file_types = (io.FileIO, io.BufferedReader, file)  # noqa
 else:
     text_type = str
+    _file_types = (io.FileIO, io.BufferedReader)
 
 
 def _accept(prefix):
@@ -51,10 +95,145 @@ def _accept(prefix):
     return False
 
 
+def _decoder_limits(size_limit=0):
+    # The size limit is used when DECODE_IMAGE_SIZE_LIMIT is None
+    if DECODE_IMAGE_SIZE_LIMIT is not None:
+        size_limit = DECODE_IMAGE_SIZE_LIMIT
+    return (
+        min(size_limit, 0xFFFFFFFF),
+        min(DECODE_IMAGE_DIMENSION_LIMIT, 0xFFFFFFFF),
+        min(DECODE_IMAGE_COUNT_LIMIT, 0xFFFFFFFF),
+    )
+
+
+def _decoded_info(icc, exif, exif_orientation, xmp):
+    """Returns the info of an image from the metadata read by the decoder."""
+    info = {}
+    if icc:
+        info["icc_profile"] = icc
+    if xmp:
+        info["xmp"] = xmp
+
+    if (exif_orientation != 1 or exif) and not IGNORE_EXIF:
+        exif_data = Image.Exif()
+        if exif:
+            exif_data.load(exif)
+            original_orientation = exif_data.get(_ORIENTATION_TAG, 1)
+        else:
+            original_orientation = 1
+        if exif_orientation != original_orientation:
+            exif_data[_ORIENTATION_TAG] = exif_orientation
+            exif = exif_data.tobytes()
+    if exif:
+        info["exif"] = exif
+    return info
+
+
+def _mmap_file(fp):
+    """
+    Returns a read-only memory map of the remainder of ``fp``, if it is a
+    regular file on disk, otherwise None.
+    """
+    # Other file objects with a fileno() (such as GzipFile) may not read the
+    # bytes of the underlying file verbatim
+    if not isinstance(fp, _file_types):
+        return None
+    try:
+        offset = fp.tell()
+        data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    except (EnvironmentError, ValueError):
+        return None
+    if offset:
+        try:
+            data = memoryview(data)[offset:]
+        except TypeError:
+            # Python 2 can't make a view of a memory map
+            data.close()
+            return None
+    return data
+
+
+def _close_mmap(data):
+    """
+    Closes a memory map from ``_mmap_file()``. If it is still in use, it is
+    left to be closed when it is garbage collected.
+    """
+    try:
+        if isinstance(data, memoryview):
+            mapped = data.obj
+            data.release()
+            data = mapped
+        if data is not None:
+            data.close()
+    except BufferError:
+        pass
+
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+def _frame_size(data):
+    if isinstance(data, tuple):
+        # The separate planes of a frame decoded without converting to RGB
+        return sum(len(plane) for plane in data)
+    return len(data)
+
+
+class _FrameCache(object):
+    """
+    A least recently used cache of decoded frames, keyed by frame index and
+    bounded by the total size in bytes of the frames' pixel data.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.currsize = 0
+        self.hits = 0
+        self.misses = 0
+        self._frames = OrderedDict()
+
+    def get(self, index):
+        try:
+            frame = self._frames.pop(index)
+        except KeyError:
+            self.misses += 1
+            return None
+        # Re-insert the frame to mark it as the most recently used
+        self._frames[index] = frame
+        self.hits += 1
+        return frame
+
+    def put(self, index, frame):
+        size = _frame_size(frame[0])
+        if size > self.maxsize:
+            return
+        self.clear(index)
+        self._frames[index] = frame
+        self.currsize += size
+        while self.currsize > self.maxsize:
+            _, evicted = self._frames.popitem(last=False)
+            self.currsize -= _frame_size(evicted[0])
+
+    def clear(self, index=None):
+        if index is None:
+            self._frames.clear()
+            self.currsize = 0
+        elif index in self._frames:
+            self.currsize -= _frame_size(self._frames.pop(index)[0])
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize, self.currsize)
+
+
 class AvifImageFile(ImageFile.ImageFile):
     format = "AVIF"
     format_description = "AVIF image"
     __frame = -1
+    __decoded_frame = -1
+    __mapped_pixels = None
+    __mmap = None
+    # Overrides DECODE_SOURCE, for files only made of items
+    _decode_source = None
 
     def _open(self):
         if not SUPPORTED:
@@ -66,8 +245,29 @@ class AvifImageFile(ImageFile.ImageFile):
         ):
             msg = "Invalid opening codec"
             raise ValueError(msg)
+        # Files on disk are memory mapped. Otherwise the decoder reads from
+        # the file object on demand, so that only the boxes needed for the
+        # image info are read here, and frame payloads are read when the frame
+        # is loaded.
+        data = self.__mmap = _mmap_file(self.fp)
+        # Embedded thumbnails are read from the container separately from the
+        # decoder, only when they are asked for
+        if data is None:
+            self.__reader = _isobmff.Reader(self.fp, self.fp.tell())
+        else:
+            self.__reader = _isobmff.Reader(data)
+        self.__items = self.__thumbnails = None
         self._decoder = _avif.AvifDecoder(
-            self.fp.read(), DECODE_CODEC_CHOICE, CHROMA_UPSAMPLING, DEFAULT_MAX_THREADS
+            self.fp if data is None else data,
+            DECODE_CODEC_CHOICE,
+            CHROMA_UPSAMPLING,
+            DEFAULT_MAX_THREADS,
+            IGNORE_EXIF,
+            IGNORE_XMP,
+            IGNORE_ICC,
+            IGNORE_ALPHA,
+            self._decode_source or DECODE_SOURCE,
+            *_decoder_limits()
         )
 
         # Get info from decoder
@@ -81,129 +281,538 @@ class AvifImageFile(ImageFile.ImageFile):
             exif_orientation,
             xmp,
         ) = self._decoder.get_info()
-        self._size = (width, height)
+        self._size = self.__full_size = (width, height)
+        self.__decoded_mode = mode
         self.is_animated = self.n_frames > 1
-        try:
-            self.mode = self.rawmode = mode
-        except AttributeError:
-            self._mode = self.rawmode = mode
+        self.__frame_cache = _FrameCache(FRAME_CACHE_SIZE if self.is_animated else 0)
+        self.__keep_fp = self.is_animated and data is None
+        if self.__keep_fp:
+            # Frames other than the current one are read from this file
+            # later on, so keep it around until the image is closed
+            self._fp = self.fp
+        self._set_mode(mode)
 
-        if icc:
-            self.info["icc_profile"] = icc
-        if xmp:
-            self.info["xmp"] = xmp
+        self.info.update(_decoded_info(icc, exif, exif_orientation, xmp))
 
-        if exif_orientation != 1 or exif:
-            exif_data = Image.Exif()
-            orientation_tag = next(
-                k for k, v in ExifTags.TAGS.items() if v == "Orientation"
-            )
-            if exif:
-                exif_data.load(exif)
-                original_orientation = exif_data.get(orientation_tag, 1)
-            else:
-                original_orientation = 1
-            if exif_orientation != original_orientation:
-                exif_data[orientation_tag] = exif_orientation
-                exif = exif_data.tobytes()
-        if exif:
-            self.info["exif"] = exif
+        self._read_timings()
         self.seek(0)
 
+    def _read_timings(self):
+        # Frame timings in milliseconds, if the decoder can read them without
+        # decoding the frames
+        self.__timings = None
+        self.info.pop("loop", None)
+        try:
+            timescale, repetition_count, timings = self._decoder.get_timings()
+        except NotImplementedError:
+            pass
+        else:
+            self.__timings = [
+                (
+                    round(1000 * (pts_in_timescales / timescale)),
+                    round(1000 * (duration_in_timescales / timescale)),
+                )
+                for pts_in_timescales, duration_in_timescales in timings
+            ]
+            # Same as the GIF loop count, where 0 loops forever. A
+            # repetition count of 0, playing once, is left out, as for GIF.
+            if not self.is_animated:
+                pass
+            elif repetition_count == -1:
+                self.info["loop"] = 0
+            elif repetition_count > 0:
+                self.info["loop"] = repetition_count
+
     def seek(self, frame):
         if not self._seek_check(frame):
             return
 
-        # Set tile
         self.__frame = frame
+        if self.__timings:
+            self.info["timestamp"], self.info["duration"] = self.__timings[frame]
+        # Every frame is decoded at the size set by draft()
+        self._set_size(self.size)
+        self._set_tile()
+
+    def _set_mode(self, mode):
+        try:
+            self.mode = self.rawmode = mode
+        except AttributeError:
+            self._mode = self.rawmode = mode
+
+    def _set_size(self, size):
+        # The decoder scales the frames to the size of the image
+        if _avif.scaling_available:
+            self._decoder.set_scaled_size((0, 0) if size == self.__full_size else size)
+        self._size = size
+
+    def _set_tile(self):
         if hasattr(ImageFile, "_Tile"):
             self.tile = [ImageFile._Tile("raw", (0, 0) + self.size, 0, self.mode)]
         else:
             self.tile = [("raw", (0, 0) + self.size, 0, self.mode)]
 
+    def draft(self, mode, size):
+        """
+        Configures the image to be decoded at a reduced size, by an integer
+        scale that keeps it at least as large as ``size``. The frames are
+        scaled before they are converted to RGB, so the full size RGB image
+        is never created. This requires libavif **1.0.0** or greater, built
+        with libyuv.
+
+        If ``mode`` is ``"YCbCr"`` and the image is stored as 8-bit, full
+        range 4:4:4 BT.601 without alpha, the decoded planes are used as they
+        are, without converting them to RGB. If ``mode`` is ``"I;16"`` and the
+        image is grayscale without alpha, it is decoded with 16 bits per pixel
+        instead of being reduced to 8 bits.
+
+        For an image sequence that also has a still image, calling this on the
+        first frame can switch to the still image (see ``DRAFT_PRIMARY_ITEM``).
+        """
+        if len(self.tile) != 1:
+            return None
+
+        if (
+            DRAFT_PRIMARY_ITEM
+            and self.is_animated
+            and self.__frame == 0
+            and (self._decode_source or DECODE_SOURCE) == "auto"
+        ):
+            self._use_primary_item()
+
+        if mode != self.mode and (
+            (mode == "YCbCr" and self._is_ycbcr_compatible())
+            or (mode == "I;16" and self.__decoded_mode == "L")
+        ):
+            self._set_mode(mode)
+            self.__frame_cache.clear()
+            self._set_tile()
+
+        width, height = self.__full_size
+        scale = 1
+        if size and _avif.scaling_available:
+            scale = max(1, min(width // size[0], height // size[1]))
+        new_size = ((width + scale - 1) // scale, (height + scale - 1) // scale)
+        if new_size != self.size:
+            self._set_size(new_size)
+            self.__frame_cache.clear()
+            self._set_tile()
+
+        return self.mode, (0, 0, width / scale, height / scale)
+
+    def _use_primary_item(self):
+        # Only the first frame is wanted, so decode the still image instead,
+        # if the file has one
+        if not self._decoder.set_source("primary"):
+            return
+        (
+            width,
+            height,
+            n_frames,
+            mode,
+            icc,
+            exif,
+            exif_orientation,
+            xmp,
+        ) = self._decoder.get_info()
+        if (width, height) != self.__full_size:
+            # The still image isn't the same picture as the sequence
+            self._decoder.set_source("auto")
+            return
+        self.n_frames = n_frames
+        for key in ("icc_profile", "exif", "xmp", "timestamp", "duration"):
+            self.info.pop(key, None)
+        self.info.update(_decoded_info(icc, exif, exif_orientation, xmp))
+        self._set_size(self.__full_size)
+        self.__decoded_mode = mode
+        self._set_mode(mode)
+        self.is_animated = self.n_frames > 1
+        self.__frame_cache = _FrameCache(0)
+        self.__decoded_frame = -1
+        self._read_timings()
+        if self.__timings:
+            self.info["timestamp"], self.info["duration"] = self.__timings[0]
+        self._set_tile()
+
+    def seek_nearest_keyframe(self, frame):
+        """
+        Seeks to the last keyframe at or before ``frame``, which can be
+        decoded without decoding any earlier frames, and returns its index.
+        """
+        self._seek_check(frame)
+        keyframe = self._decoder.nearest_keyframe(frame)
+        self.seek(keyframe)
+        return keyframe
+
+    def _item_properties(self):
+        # The items of the file's meta box, or False if it has none
+        if self.__items is None:
+            self.__items = False
+            try:
+                meta = _isobmff.read_top_level_boxes(self.__reader, (b"meta",))
+                if b"meta" in meta:
+                    self.__items = _isobmff.ItemProperties(meta[b"meta"])
+            except (SyntaxError, struct.error):
+                pass
+        return self.__items
+
+    def _thumbnail_items(self):
+        if self.__thumbnails is None:
+            self.__thumbnails = []
+            items = self._item_properties()
+            if items:
+                self.__thumbnails = _isobmff.thumbnail_items(items)
+            # Smallest first
+            self.__thumbnails.sort(key=lambda thumbnail: thumbnail[2] * thumbnail[3])
+        return self.__thumbnails
+
+    def get_thumbnails(self):
+        """
+        Returns the sizes of the thumbnails embedded in the file, which can be
+        loaded with :py:meth:`load_thumbnail`.
+        """
+        return [(width, height) for _, _, width, height in self._thumbnail_items()]
+
+    def load_thumbnail(self, size=None):
+        """
+        Decodes an embedded thumbnail, without decoding the full size image,
+        and returns it as a new image. This is the smallest thumbnail that is
+        at least as large as ``size``, or else the largest one. Returns None
+        if the file has no thumbnails.
+        """
+        thumbnails = self._thumbnail_items()
+        if not thumbnails:
+            return None
+        thumbnail = thumbnails[-1]
+        if size:
+            thumbnail = next(
+                (t for t in thumbnails if t[2] >= size[0] and t[3] >= size[1]),
+                thumbnail,
+            )
+        item_id, alpha_id = thumbnail[:2]
+        data = _isobmff.build_item_file(self.__reader, self.__items, item_id, alpha_id)
+        im = _AvifItemImageFile(io.BytesIO(data))
+        im.load()
+        return im
+
+    def decode_region(self, box):
+        """
+        Returns the ``(left, upper, right, lower)`` region of the current
+        frame, like :py:meth:`~PIL.Image.Image.crop`. If the image is a grid
+        of tiles and hasn't been loaded yet, only the tiles that intersect the
+        region are decoded. Otherwise, the whole frame is decoded and cropped.
+
+        Calling ``crop()`` on an image that hasn't been loaded does the same.
+        """
+        region = self._decode_grid_region(box)
+        if region is None:
+            return super(AvifImageFile, self).crop(box)
+        return region
+
+    def crop(self, box=None):
+        if box is None:
+            return super(AvifImageFile, self).crop(box)
+        return self.decode_region(box)
+
+    def _decode_grid_region(self, box):
+        if (
+            not self.tile
+            or self.is_animated
+            or DECODE_SOURCE == "tracks"
+            or self.size != self.__full_size
+            or self.mode != self.__decoded_mode
+        ):
+            return None
+        left, top, right, bottom = [int(round(value)) for value in box]
+        width, height = self.size
+        if not (0 <= left < right <= width and 0 <= top < bottom <= height):
+            return None
+        items = self._item_properties()
+        if not items:
+            return None
+
+        # Unless each pixel has its own chroma sample, upsampling the chroma
+        # of the pixels on the edges of the region also uses the neighbouring
+        # chroma samples, so the cells next to them are decoded as well and
+        # cropped off, to give the same pixels as decoding the whole frame
+        margin = 0
+        subsampling = self._decoder.get_yuv_info()[1]
+        if subsampling not in ("4:4:4", "4:0:0") and CHROMA_UPSAMPLING != "nearest":
+            margin = 2
+        try:
+            region_file = _isobmff.grid_region_file(
+                self.__reader,
+                items,
+                (
+                    max(left - margin, 0),
+                    max(top - margin, 0),
+                    min(right + margin, width),
+                    min(bottom + margin, height),
+                ),
+            )
+        except (SyntaxError, struct.error):
+            return None
+        if region_file is None:
+            return None
+
+        data, (x, y) = region_file
+        grid = _AvifItemImageFile(io.BytesIO(data))
+        try:
+            grid.load()
+            region = grid.crop((left - x, top - y, right - x, bottom - y))
+        finally:
+            grid.close()
+        return self._new(region.im)
+
+    def _is_ycbcr_compatible(self):
+        depth, subsampling, yuv_range, matrix, alpha = self._decoder.get_yuv_info()
+        return (
+            depth == 8
+            and subsampling == "4:4:4"
+            and yuv_range == "full"
+            and matrix in _YCBCR_MATRIX_COEFFICIENTS
+            and not alpha
+        )
+
     def load(self):
         if self.tile:
             # We need to load the image data for this frame
-            (
-                data,
-                timescale,
-                pts_in_timescales,
-                duration_in_timescales,
-            ) = self._decoder.get_frame(self.__frame)
+            frame = self.__frame_cache.get(self.__frame)
+            if frame is None:
+                frame = self._decode_frame()
+                self.__frame_cache.put(self.__frame, frame)
+            data, timescale, pts_in_timescales, duration_in_timescales = frame
+            if self.__frame_cache.maxsize and self.mode in Image._MAPMODES:
+                # Don't let changes to the image alter the cached frame
+                data = bytearray(data)
             self.info["timestamp"] = round(1000 * (pts_in_timescales / timescale))
             self.info["duration"] = round(1000 * (duration_in_timescales / timescale))
 
-            if self.fp and self._exclusive_fp:
+            if self.fp and self._exclusive_fp and not self.__keep_fp:
                 self.fp.close()
-            self.fp = BytesIO(data)
+            self.fp = None
+
+            self._load_pixels(data)
+            self.tile = []
 
         return super(AvifImageFile, self).load()
 
+    def _decode_frame(self, depth=None):
+        if depth is None:
+            depth = 16 if self.mode == "I;16" else 8
+        # When reading frames in order, continue from the last decoded one
+        sequential = self.__frame == self.__decoded_frame + 1
+        # The decoder's position is unknown if decoding fails
+        self.__decoded_frame = -2
+        if self.mode == "YCbCr" and depth == 8:
+            planes, _, timescale, pts, duration = self._decoder.get_yuv_frame(
+                self.__frame
+            )
+            frame = (planes[:3], timescale, pts, duration)
+        elif sequential and depth == 8:
+            frame = next(self._decoder)
+        else:
+            frame = self._decoder.get_frame(self.__frame, depth)
+        self.__decoded_frame = self.__frame
+        return frame
+
+    def get_frame_timings(self):
+        """
+        Returns a list of the timestamp and duration in milliseconds of every
+        frame, which are read without decoding the frames. This requires
+        libavif **0.9.1** or greater, and returns None otherwise.
+        """
+        return list(self.__timings) if self.__timings is not None else None
+
+    def get_frame_16bit(self):
+        """
+        Decodes the current frame with 16 bits per sample, without reducing
+        the precision of high bit depth images. Returns the mode, one of
+        ``"RGB"``, ``"RGBA"``, ``"L"`` or ``"LA"``, the size, which is the
+        reduced size if :py:meth:`draft` was called, and a bytearray of little
+        endian samples in the order of that mode's channels.
+        """
+        return self.__decoded_mode, self.size, self._decode_frame(16)[0]
+
+    def frame_cache_info(self):
+        """
+        Returns the hits, misses, maximum size and current size in bytes of
+        the decoded frame cache (see ``FRAME_CACHE_SIZE``).
+        """
+        return self.__frame_cache.info()
+
+    def _load_pixels(self, data):
+        if self.mode == "YCbCr":
+            bands = [
+                Image.core.map_buffer(plane, self.size, "raw", 0, ("L", 0, 1))
+                for plane in data
+            ]
+            self.im = Image.core.merge(self.mode, *bands)
+            self.__mapped_pixels = None
+        elif self.mode in Image._MAPMODES:
+            # The decoded frame is a private, writable buffer in the same
+            # layout as the image memory, so it can be used without copying
+            self.im = Image.core.map_buffer(
+                data, self.size, "raw", 0, (self.mode, 0, 1)
+            )
+            self.__mapped_pixels = (self.im, data)
+        else:
+            # Unpack into the existing image memory, if there is any
+            im = self.im
+            if im is None or im.mode != self.mode or im.size != self.size:
+                self.im = Image.core.new(self.mode, self.size)
+            self.frombytes(data)
+            self.__mapped_pixels = None
+        self.readonly = 0
+
+    def _mapped_pixels(self):
+        # The buffer that the image memory is mapped from, which has the
+        # current pixels for as long as the image memory isn't replaced
+        mapped = self.__mapped_pixels
+        if mapped is not None and mapped[0] is self.im:
+            return mapped[1]
+        return None
+
     def load_seek(self, pos):
         pass
 
     def tell(self):
         return self.__frame
 
+    def _release_file(self):
+        # The decoder and the reader hold on to the memory map of the file,
+        # which keeps the file open (and locked, on Windows) until it is closed
+        self._decoder = None
+        self.__reader = None
+        data, self.__mmap = self.__mmap, None
+        _close_mmap(data)
+
+    def __exit__(self, *args):
+        self._release_file()
+        return super(AvifImageFile, self).__exit__(*args)
+
+    def close(self):
+        self._release_file()
+        super(AvifImageFile, self).close()
+
+
+class _AvifItemImageFile(AvifImageFile):
+    # A file built from some of the items of another file, such as a
+    # thumbnail, to decode them without the rest of the file
+    _decode_source = "primary"
+
+
+def _read_source(source):
+    """
+    Returns the contents of ``source``, a filename, file object or bytes-like
+    object, as a buffer, and the memory map that the buffer is in, if any.
+    The map is closed with ``_close_mmap()`` once the buffer isn't used.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return source, None
+    if hasattr(source, "read"):
+        return _map_or_read(source)
+    with open(source, "rb") as f:
+        return _map_or_read(f)
+
+
+def _map_or_read(fp):
+    # On Python 2, memory maps don't have the buffer interface that the
+    # batch decoder needs
+    data = None if sys.version_info[0] == 2 else _mmap_file(fp)
+    if data is None:
+        return fp.read(), None
+    return data, data
+
+
+def decode_many(sources, max_workers=None, threads_per_image=1):
+    """
+    Decodes the first frame of each of the given AVIF files at once, on a pool
+    of up to ``max_workers`` native threads (by default, one per CPU) with
+    ``threads_per_image`` decoder threads each. The files are parsed, decoded
+    and converted without holding the GIL.
+
+    ``sources`` can be filenames, file objects or bytes-like objects. Returns
+    a list with an image, or the exception raised while reading it, for each
+    of the sources in order. The images have no metadata. Unless
+    ``DECODE_IMAGE_SIZE_LIMIT`` is set, images with more than twice
+    ``Image.MAX_IMAGE_PIXELS`` are rejected by the decoder.
+    """
+    results = []
+    buffers = []
+    maps = []
+    indices = []
+    try:
+        for source in sources:
+            try:
+                data, mapped = _read_source(source)
+            except (OSError, IOError) as e:
+                results.append(e)
+            else:
+                buffers.append(data)
+                if mapped is not None:
+                    maps.append(mapped)
+                indices.append(len(results))
+                results.append(None)
+
+        decoded = _avif.decode_many(
+            buffers,
+            DECODE_CODEC_CHOICE,
+            CHROMA_UPSAMPLING,
+            max_workers or 0,
+            threads_per_image,
+            # Pillow doesn't check these images for decompression bombs, so
+            # libavif rejects them before they are decoded
+            *_decoder_limits(
+                2 * Image.MAX_IMAGE_PIXELS if Image.MAX_IMAGE_PIXELS else 0
+            )
+        )
+    finally:
+        # The decoded pixels are copies, so the files can be closed
+        del buffers[:]
+        for mapped in maps:
+            _close_mmap(mapped)
+    for index, result in zip(indices, decoded):
+        if not isinstance(result, Exception):
+            mode, size, data = result
+            result = Image.frombuffer(mode, size, data, "raw", mode, 0, 1)
+            # The pixels are a private, writable buffer
+            result.readonly = 0
+        results[index] = result
+    return results
+
 
 def _save_all(im, fp, filename):
     _save(im, fp, filename, save_all=True)
 
 
+def _file_data(data):
+    # File objects are given the encoded data as bytes or a memoryview of
+    # it, which they all accept, rather than the encoder's own buffer type
+    return data if isinstance(data, bytes) else memoryview(data)
+
+
 def _save(im, fp, filename, save_all=False):
-    info = im.encoderinfo.copy()
-    if save_all:
-        append_images = list(info.get("append_images", []))
-    else:
-        append_images = []
+    fp.write(_file_data(_encode(im, im.encoderinfo.copy(), save_all)))
 
-    total = 0
-    for ims in [im] + append_images:
-        total += getattr(ims, "n_frames", 1)
 
-    qmin = info.get("qmin", -1)
-    qmax = info.get("qmax", -1)
+def _encoder_options(info):
+    """
+    Validates the save options in ``info`` that don't depend on the image,
+    and returns them with their defaults filled in.
+    """
     quality = info.get("quality", 75)
     if not isinstance(quality, int) or quality < 0 or quality > 100:
         msg = "Invalid quality setting"
         raise ValueError(msg)
 
-    duration = info.get("duration", 0)
-    subsampling = info.get("subsampling", "4:2:0")
-    speed = info.get("speed", 6)
-    max_threads = info.get("max_threads", DEFAULT_MAX_THREADS)
     codec = info.get("codec", "auto")
     if codec != "auto" and not _avif.encoder_codec_available(codec):
         msg = "Invalid saving codec"
         raise ValueError(msg)
-    range_ = info.get("range", "full")
+
     tile_rows_log2 = info.get("tile_rows", 0)
     tile_cols_log2 = info.get("tile_cols", 0)
-    alpha_premultiplied = bool(info.get("alpha_premultiplied", False))
-    autotiling = bool(info.get("autotiling", tile_rows_log2 == tile_cols_log2 == 0))
-
-    icc_profile = info.get("icc_profile", im.info.get("icc_profile"))
-    exif = info.get("exif", im.info.get("exif"))
-    if isinstance(exif, Image.Exif):
-        exif = exif.tobytes()
-
-    exif_orientation = 0
-    if exif:
-        exif_data = Image.Exif()
-        try:
-            exif_data.load(exif)
-        except SyntaxError:
-            pass
-        else:
-            orientation_tag = next(
-                k for k, v in ExifTags.TAGS.items() if v == "Orientation"
-            )
-            exif_orientation = exif_data.get(orientation_tag) or 0
-
-    xmp = info.get("xmp", im.info.get("xmp") or im.info.get("XML:com.adobe.xmp"))
-
-    if isinstance(xmp, text_type):
-        xmp = xmp.encode("utf-8")
 
     advanced = info.get("advanced")
     if advanced is not None:
@@ -225,32 +834,169 @@ def _save(im, fp, filename, save_all=False):
             [(str(k).encode("utf-8"), str(v).encode("utf-8")) for k, v in advanced]
         )
 
-    # Setup the AVIF encoder
+    return {
+        "qmin": info.get("qmin", -1),
+        "qmax": info.get("qmax", -1),
+        "quality": quality,
+        "duration": info.get("duration", 0),
+        "subsampling": info.get("subsampling", "4:2:0"),
+        "speed": info.get("speed", 6),
+        "max_threads": info.get("max_threads", DEFAULT_MAX_THREADS),
+        "codec": codec,
+        "range": info.get("range", "full"),
+        "tile_rows": tile_rows_log2,
+        "tile_cols": tile_cols_log2,
+        "alpha_premultiplied": bool(info.get("alpha_premultiplied", False)),
+        "autotiling": bool(
+            info.get("autotiling", tile_rows_log2 == tile_cols_log2 == 0)
+        ),
+        "thumbnail": info.get("thumbnail"),
+        "advanced": advanced,
+        "pipeline": bool(info.get("pipeline", True)),
+    }
+
+
+def _new_encoder(size, info, im_info, options, pipeline):
+    """
+    Returns a new ``_avif.AvifEncoder`` for images of ``size``, with the
+    metadata from ``info`` or else ``im_info``, its ICC profile and its EXIF
+    orientation.
+    """
+    icc_profile = info.get("icc_profile", im_info.get("icc_profile"))
+    exif = info.get("exif", im_info.get("exif"))
+    if isinstance(exif, Image.Exif):
+        exif = exif.tobytes()
+
+    exif_orientation = 0
+    if exif:
+        exif_data = Image.Exif()
+        try:
+            exif_data.load(exif)
+        except SyntaxError:
+            pass
+        else:
+            exif_orientation = exif_data.get(_ORIENTATION_TAG) or 0
+
+    xmp = info.get("xmp", im_info.get("xmp") or im_info.get("XML:com.adobe.xmp"))
+
+    if isinstance(xmp, text_type):
+        xmp = xmp.encode("utf-8")
+
     enc = _avif.AvifEncoder(
-        im.size[0],
-        im.size[1],
-        subsampling,
-        qmin,
-        qmax,
-        quality,
-        speed,
-        max_threads,
-        codec,
-        range_,
-        tile_rows_log2,
-        tile_cols_log2,
-        alpha_premultiplied,
-        autotiling,
+        size[0],
+        size[1],
+        options["subsampling"],
+        options["qmin"],
+        options["qmax"],
+        options["quality"],
+        options["speed"],
+        options["max_threads"],
+        options["codec"],
+        options["range"],
+        options["tile_rows"],
+        options["tile_cols"],
+        options["alpha_premultiplied"],
+        options["autotiling"],
         icc_profile or b"",
         exif or b"",
         exif_orientation,
         xmp or b"",
-        advanced,
+        options["advanced"],
+        # Encode each frame of an animation while the next one is prepared
+        pipeline,
+    )
+    return enc, icc_profile, exif_orientation
+
+
+def _prepare_frame(im):
+    """
+    Returns ``im`` converted to RGB or RGBA if it is in another mode, its
+    mode, and a buffer of its pixels for the encoder.
+    """
+    frame = im
+    rawmode = im.mode
+    if im.mode not in {"RGB", "RGBA"}:
+        alpha = (
+            "A" in im.mode
+            or "a" in im.mode
+            or (im.mode == "P" and "A" in im.im.getpalettemode())
+            or (im.mode == "P" and im.info.get("transparency", None) is not None)
+        )
+        rawmode = "RGBA" if alpha else "RGB"
+        frame = im.convert(rawmode)
+
+    # The encoder reads the pixels from any buffer without copying them, so
+    # frames decoded by this plugin are used as they are, and others are only
+    # copied out of the image once
+    pixels = None
+    if isinstance(frame, AvifImageFile) and rawmode == frame.mode:
+        pixels = frame._mapped_pixels()
+    if pixels is None:
+        pixels = frame.tobytes("raw", rawmode)
+    return frame, rawmode, pixels
+
+
+def _frame_duration(duration, frame_idx):
+    if isinstance(duration, (list, tuple)):
+        return duration[frame_idx]
+    return duration
+
+
+def _add_thumbnail(data, thumbnail, icc_profile, exif_orientation, options):
+    # libavif can't write thumbnails, so the thumbnail is encoded as a
+    # separate image and its items are added to the file
+    thumbnail_options = dict(
+        options,
+        duration=0,
+        tile_rows=0,
+        tile_cols=0,
+        autotiling=True,
+        thumbnail=None,
+    )
+    # The thumbnail only gets the orientation from the image's EXIF, which
+    # the encoder writes as the irot and imir properties that are copied
+    # along with its item
+    exif = b""
+    if exif_orientation:
+        exif_data = Image.Exif()
+        exif_data[_ORIENTATION_TAG] = exif_orientation
+        exif = exif_data.tobytes()
+    thumbnail_info = {"icc_profile": icc_profile or b"", "exif": exif, "xmp": b""}
+    thumbnail_data = _encode(thumbnail, thumbnail_info, options=thumbnail_options)
+    return _isobmff.add_thumbnail(bytes(data), bytes(thumbnail_data))
+
+
+def _encode(im, info, save_all=False, should_stop=None, options=None):
+    """
+    Encodes ``im`` with the save options ``info`` and returns the AVIF file,
+    as an object supporting the buffer protocol that owns the encoder output.
+    If ``should_stop`` is given, it is called before each frame is added, and
+    if it returns True, the encoding is abandoned and None is returned.
+    ``options`` are the result of ``_encoder_options(info)``, if they have
+    already been validated.
+    """
+    if options is None:
+        options = _encoder_options(info)
+
+    if save_all:
+        append_images = list(info.get("append_images", []))
+    else:
+        append_images = []
+
+    total = 0
+    for ims in [im] + append_images:
+        total += getattr(ims, "n_frames", 1)
+
+    thumbnail_size = options["thumbnail"]
+    thumbnail = None
+
+    # Setup the AVIF encoder
+    enc, icc_profile, exif_orientation = _new_encoder(
+        im.size, info, im.info, options, options["pipeline"] and total > 1
     )
 
     # Add each frame
     frame_idx = 0
-    frame_duration = 0
     cur_idx = im.tell()
     is_single_frame = total == 1
     try:
@@ -259,35 +1005,22 @@ def _save(im, fp, filename, save_all=False):
             nfr = getattr(ims, "n_frames", 1)
 
             for idx in range(nfr):
+                if should_stop is not None and should_stop():
+                    return None
                 ims.seek(idx)
                 ims.load()
 
                 # Make sure image mode is supported
-                frame = ims
-                rawmode = ims.mode
-                if ims.mode not in {"RGB", "RGBA"}:
-                    alpha = (
-                        "A" in ims.mode
-                        or "a" in ims.mode
-                        or (ims.mode == "P" and "A" in ims.im.getpalettemode())
-                        or (
-                            ims.mode == "P"
-                            and ims.info.get("transparency", None) is not None
-                        )
-                    )
-                    rawmode = "RGBA" if alpha else "RGB"
-                    frame = ims.convert(rawmode)
-
-                # Update frame duration
-                if isinstance(duration, (list, tuple)):
-                    frame_duration = duration[frame_idx]
-                else:
-                    frame_duration = duration
+                frame, rawmode, pixels = _prepare_frame(ims)
+
+                if thumbnail_size and frame_idx == 0:
+                    thumbnail = frame.copy()
+                    thumbnail.thumbnail(thumbnail_size)
 
                 # Append the frame to the animation encoder
                 enc.add(
-                    frame.tobytes("raw", rawmode),
-                    int(frame_duration),
+                    pixels,
+                    int(_frame_duration(options["duration"], frame_idx)),
                     frame.size[0],
                     frame.size[1],
                     rawmode,
@@ -303,13 +1036,174 @@ def _save(im, fp, filename, save_all=False):
     finally:
         im.seek(cur_idx)
 
-    # Get the final output from the encoder
+    # Get the final output from the encoder, which isn't copied into bytes
     data = enc.finish()
     if data is None:
         msg = "cannot write file as AVIF (encoder returned None)"
         raise OSError(msg)
 
-    fp.write(data)
+    if thumbnail is not None:
+        data = _add_thumbnail(data, thumbnail, icc_profile, exif_orientation, options)
+
+    return data
+
+
+class EncoderSession(object):
+    """
+    Encodes many images with the same save options, which are the same as for
+    ``im.save(fp, "AVIF", **options)``. The options are validated once, when
+    the session is created, rather than on every save. A session has no
+    mutable state, so it can be shared between threads.
+    """
+
+    def __init__(self, **options):
+        self.options = options
+        self._encoder_options = _encoder_options(options)
+
+    def encode(self, im):
+        """
+        Encodes ``im``, or all of its frames if the session was created with
+        ``save_all=True``, and returns the AVIF file as bytes.
+        """
+        return bytes(
+            _encode(
+                im,
+                self.options,
+                self.options.get("save_all", False),
+                options=self._encoder_options,
+            )
+        )
+
+
+class AvifWriter(object):
+    """
+    Writes an AVIF image to ``fp``, a filename or a file object, one frame at
+    a time. The options are the same as for ``im.save(fp, "AVIF", **options)``
+    with ``save_all=True``, apart from ``append_images``. Each frame is
+    encoded when it is added, so the frames don't have to be kept in memory,
+    and the file is written when the writer is closed.
+    """
+
+    def __init__(self, fp, **options):
+        self.info = options
+        self._options = _encoder_options(options)
+        if hasattr(fp, "write"):
+            self.fp = fp
+            self._exclusive_fp = False
+        else:
+            self.fp = open(fp, "wb")
+            self._exclusive_fp = True
+        self.n_frames = 0
+        self._enc = None
+        self._size = None
+        self._icc_profile = None
+        self._exif_orientation = 0
+        self._thumbnail = None
+        self._first_frame = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        if args[0] is None:
+            self.close()
+        else:
+            self._release()
+
+    def add_frame(self, frame, duration=None, size=None, mode=None):
+        """
+        Adds a frame, which is either an image or a buffer of pixels. The
+        ``mode`` of a buffer must be ``"RGB"`` or ``"RGBA"``, and its ``size``
+        defaults to the size of the previous frames. ``duration`` is in
+        milliseconds, and defaults to the ``duration`` option. The frame can
+        be changed or reused as soon as this returns.
+        """
+        if self.fp is None:
+            msg = "cannot add a frame to a closed writer"
+            raise ValueError(msg)
+        if duration is None:
+            duration = _frame_duration(self._options["duration"], self.n_frames)
+
+        if isinstance(frame, Image.Image):
+            frame.load()
+            im_info = frame.info
+            frame, mode, pixels = _prepare_frame(frame)
+            size = frame.size
+        else:
+            if mode not in ("RGB", "RGBA"):
+                msg = "the mode of a buffer must be RGB or RGBA"
+                raise ValueError(msg)
+            size = size or self._size
+            if size is None:
+                msg = "the size of the first frame must be given"
+                raise ValueError(msg)
+            im_info = {}
+            pixels = frame
+            frame = None
+
+        if self._enc is None:
+            self._enc, self._icc_profile, self._exif_orientation = _new_encoder(
+                size, self.info, im_info, self._options, self._options["pipeline"]
+            )
+            self._size = size
+            if self._options["thumbnail"]:
+                if frame is None:
+                    frame = Image.frombytes(mode, size, bytes(pixels))
+                self._thumbnail = frame.copy()
+                self._thumbnail.thumbnail(self._options["thumbnail"])
+
+        if self.n_frames == 0:
+            # A single frame is encoded as a still image, so the first frame
+            # is held back until it is known whether any others follow
+            if not isinstance(pixels, bytes):
+                pixels = bytes(pixels)
+            self._first_frame = (pixels, int(duration), size, mode)
+        else:
+            if self._first_frame is not None:
+                self._add(self._first_frame, False)
+                self._first_frame = None
+            self._add((pixels, int(duration), size, mode), False)
+        self.n_frames += 1
+
+    def _add(self, frame, is_single_frame):
+        pixels, duration, size, mode = frame
+        self._enc.add(pixels, duration, size[0], size[1], mode, is_single_frame)
+
+    def close(self):
+        """
+        Finishes encoding, writes the file and closes ``fp`` if the writer
+        opened it.
+        """
+        if self.fp is None:
+            return
+        try:
+            if self._enc is None:
+                msg = "cannot write an AVIF image without frames"
+                raise ValueError(msg)
+            if self._first_frame is not None:
+                self._add(self._first_frame, True)
+                self._first_frame = None
+
+            data = self._enc.finish()
+            if self._thumbnail is not None:
+                data = _add_thumbnail(
+                    data,
+                    self._thumbnail,
+                    self._icc_profile,
+                    self._exif_orientation,
+                    self._options,
+                )
+            self.fp.write(_file_data(data))
+        finally:
+            self._release()
+
+    def _release(self):
+        self._enc = None
+        self._first_frame = None
+        self._thumbnail = None
+        if self.fp is not None and self._exclusive_fp:
+            self.fp.close()
+        self.fp = None
 
 
 # Prevent Pillow's AVIF plugin from replacing this plugin
@@ -1,5 +1,15 @@
 from . import AvifImagePlugin
+from .AvifImagePlugin import AvifWriter, EncoderSession, decode_many
+from ._isobmff import AvifProbeInfo, probe, probe_many
 
 
-__all__ = ["AvifImagePlugin"]
+__all__ = [
+    "AvifImagePlugin",
+    "AvifProbeInfo",
+    "AvifWriter",
+    "EncoderSession",
+    "decode_many",
+    "probe",
+    "probe_many",
+]
 __version__ = "1.5.2"
@@ -1,6 +1,7 @@
 #define PY_SSIZE_T_CLEAN
 
 #include <Python.h>
+#include "pythread.h"
 #include "avif/avif.h"
 
 #if AVIF_VERSION < 80300
@@ -9,6 +10,12 @@
 #define AVIF_CHROMA_UPSAMPLING_FASTEST AVIF_CHROMA_UPSAMPLING_NEAREST
 #endif
 
+#if AVIF_VERSION < 1000000
+// Not all of the older versions of libavif have a result for a failed
+// allocation
+#define AVIF_RESULT_OUT_OF_MEMORY AVIF_RESULT_UNKNOWN_ERROR
+#endif
+
 // Encoder type
 typedef struct {
     PyObject_HEAD
@@ -18,22 +25,81 @@ typedef struct {
     PyObject *exif_bytes;
     PyObject *xmp_bytes;
     int first_frame;
+    // When pipelining, each frame is encoded on a worker thread while the
+    // next one is prepared. Releasing the ready lock hands the worker a
+    // frame, or no frame to stop it, and the done lock is held until the
+    // worker is done with it.
+    PyThread_type_lock pipeline_ready;
+    PyThread_type_lock pipeline_done;
+    int pipeline_running;
+    avifImage *pending_frame;
+    uint32_t pending_duration;
+    uint32_t pending_flags;
+    avifResult pending_result;
 } AvifEncoderObject;
 
 static PyTypeObject AvifEncoder_Type;
 
+#if PY_VERSION_HEX >= 0x03000000
+// Encoded file, which owns the avifRWData written by the encoder and exposes
+// it through the buffer protocol, so that it doesn't have to be copied
+typedef struct {
+    PyObject_HEAD
+    avifRWData raw;
+} AvifDataObject;
+
+static PyTypeObject AvifData_Type;
+#endif
+
 // Decoder type
 typedef struct {
     PyObject_HEAD
     avifDecoder *decoder;
-    PyObject *data;
+    Py_buffer buffer;
     avifChromaUpsampling upsampling;
+    PyThread_type_lock lock;
+    PyObject *keyframes;
+    uint32_t scaled_width;
+    uint32_t scaled_height;
+    int ignore_exif;
+    int ignore_xmp;
+    int ignore_icc;
+    int ignore_alpha;
 } AvifDecoderObject;
 
 static PyTypeObject AvifDecoder_Type;
 
+// The decoder is used with the GIL released, so calls on the same object
+// from different threads are serialized with a per-object lock.
+static void
+_decoder_lock(AvifDecoderObject *self) {
+    if (!PyThread_acquire_lock(self->lock, NOWAIT_LOCK)) {
+        Py_BEGIN_ALLOW_THREADS;
+        PyThread_acquire_lock(self->lock, WAIT_LOCK);
+        Py_END_ALLOW_THREADS;
+    }
+}
+
+static void
+_decoder_unlock(AvifDecoderObject *self) {
+    PyThread_release_lock(self->lock);
+}
+
+// avifIO that reads from a Python file object on demand
+typedef struct {
+    avifIO io;
+    PyObject *fp;
+    PY_LONG_LONG start;
+    uint8_t *buffer;
+    size_t buffer_size;
+} avifPyFileIO;
+
 static int default_max_threads = 0;
 
+// The codecs that libavif was built with can't change, so whether "auto"
+// encodes with aom is only looked up once
+static int auto_encoder_is_aom = -1;
+
 static void
 init_max_threads(void) {
     PyObject *os = NULL;
@@ -322,11 +388,12 @@ AvifEncoderNew(PyObject *self_, PyObject *args) {
     char *range;
 
     PyObject *advanced;
+    int pipeline = 0;
     int error = 0;
 
     if (!PyArg_ParseTuple(
             args,
-            "IIsiiiiissiiOOSSiSO",
+            "IIsiiiiissiiOOSSiSO|i",
             &width,
             &height,
             &subsampling,
@@ -345,7 +412,8 @@ AvifEncoderNew(PyObject *self_, PyObject *args) {
             &exif_bytes,
             &exif_orientation,
             &xmp_bytes,
-            &advanced)) {
+            &advanced,
+            &pipeline)) {
         return NULL;
     }
 
@@ -409,9 +477,13 @@ AvifEncoderNew(PyObject *self_, PyObject *args) {
         max_threads = default_max_threads;
     }
 
-    int is_aom_encode = strcmp(codec, "aom") == 0 ||
-                        (strcmp(codec, "auto") == 0 &&
-                         _codec_available("aom", AVIF_CODEC_FLAG_CAN_ENCODE));
+    int is_aom_encode = strcmp(codec, "aom") == 0;
+    if (!is_aom_encode && strcmp(codec, "auto") == 0) {
+        if (auto_encoder_is_aom == -1) {
+            auto_encoder_is_aom = _codec_available("aom", AVIF_CODEC_FLAG_CAN_ENCODE);
+        }
+        is_aom_encode = auto_encoder_is_aom;
+    }
     encoder->maxThreads = is_aom_encode && max_threads > 64 ? 64 : max_threads;
 
 #if AVIF_VERSION < 1000000
@@ -477,6 +549,21 @@ AvifEncoderNew(PyObject *self_, PyObject *args) {
     self->icc_bytes = NULL;
     self->exif_bytes = NULL;
     self->xmp_bytes = NULL;
+    self->pending_frame = NULL;
+    self->pipeline_ready = NULL;
+    self->pipeline_done = NULL;
+    self->pipeline_running = 0;
+    if (pipeline) {
+        self->pipeline_ready = PyThread_allocate_lock();
+        self->pipeline_done = PyThread_allocate_lock();
+        if (self->pipeline_ready == NULL || self->pipeline_done == NULL) {
+            PyErr_SetString(PyExc_MemoryError, "Can't allocate pipeline locks");
+            error = 1;
+            goto end;
+        }
+        // Held until there is a frame for the worker
+        PyThread_acquire_lock(self->pipeline_ready, NOWAIT_LOCK);
+    }
 
     avifResult result;
     if (PyBytes_GET_SIZE(icc_bytes)) {
@@ -578,6 +665,12 @@ end:
             Py_XDECREF(self->icc_bytes);
             Py_XDECREF(self->exif_bytes);
             Py_XDECREF(self->xmp_bytes);
+            if (self->pipeline_ready) {
+                PyThread_free_lock(self->pipeline_ready);
+            }
+            if (self->pipeline_done) {
+                PyThread_free_lock(self->pipeline_done);
+            }
             PyObject_Del(self);
         }
         return NULL;
@@ -586,8 +679,92 @@ end:
     return (PyObject *)self;
 }
 
+static void
+_encoder_pipeline_thread(void *arg) {
+    AvifEncoderObject *self = (AvifEncoderObject *)arg;
+
+    for (;;) {
+        PyThread_acquire_lock(self->pipeline_ready, WAIT_LOCK);
+        if (self->pending_frame == NULL) {
+            break;
+        }
+        self->pending_result = avifEncoderAddImage(
+            self->encoder,
+            self->pending_frame,
+            self->pending_duration,
+            self->pending_flags);
+        PyThread_release_lock(self->pipeline_done);
+    }
+    PyThread_release_lock(self->pipeline_done);
+}
+
+// Hands a frame over to the worker thread, starting it if it isn't running.
+// Returns 0 if the thread can't be started, in which case the caller
+// encodes the frame itself.
+static int
+_encoder_submit(
+    AvifEncoderObject *self, avifImage *frame, uint32_t duration, uint32_t flags) {
+    if (!self->pipeline_running) {
+        if ((long)PyThread_start_new_thread(_encoder_pipeline_thread, self) == -1) {
+            return 0;
+        }
+        self->pipeline_running = 1;
+    }
+
+    // There is no pending frame, so this doesn't block
+    PyThread_acquire_lock(self->pipeline_done, WAIT_LOCK);
+    self->pending_frame = frame;
+    self->pending_duration = duration;
+    self->pending_flags = flags;
+    PyThread_release_lock(self->pipeline_ready);
+    return 1;
+}
+
+// Waits for the pending frame to be encoded, if there is one, and returns
+// the result of encoding it
+static avifResult
+_encoder_wait(AvifEncoderObject *self) {
+    if (self->pending_frame == NULL) {
+        return AVIF_RESULT_OK;
+    }
+
+    Py_BEGIN_ALLOW_THREADS;
+    PyThread_acquire_lock(self->pipeline_done, WAIT_LOCK);
+    Py_END_ALLOW_THREADS;
+    PyThread_release_lock(self->pipeline_done);
+
+    if (self->pending_frame != self->image) {
+        avifImageDestroy(self->pending_frame);
+    }
+    self->pending_frame = NULL;
+    return self->pending_result;
+}
+
+// Waits for the pending frame, and then for the worker thread to exit
+static avifResult
+_encoder_stop_pipeline(AvifEncoderObject *self) {
+    avifResult result = _encoder_wait(self);
+
+    if (self->pipeline_running) {
+        PyThread_acquire_lock(self->pipeline_done, WAIT_LOCK);
+        PyThread_release_lock(self->pipeline_ready);
+
+        Py_BEGIN_ALLOW_THREADS;
+        PyThread_acquire_lock(self->pipeline_done, WAIT_LOCK);
+        Py_END_ALLOW_THREADS;
+        PyThread_release_lock(self->pipeline_done);
+        self->pipeline_running = 0;
+    }
+    return result;
+}
+
 PyObject *
 _encoder_dealloc(AvifEncoderObject *self) {
+    if (self->pipeline_done) {
+        _encoder_stop_pipeline(self);
+        PyThread_free_lock(self->pipeline_ready);
+        PyThread_free_lock(self->pipeline_done);
+    }
     if (self->encoder) {
         avifEncoderDestroy(self->encoder);
     }
@@ -602,8 +779,8 @@ _encoder_dealloc(AvifEncoderObject *self) {
 
 PyObject *
 _encoder_add(AvifEncoderObject *self, PyObject *args) {
-    uint8_t *rgb_bytes;
-    Py_ssize_t size;
+    Py_buffer buffer;
+    unsigned int row_bytes = 0;
     unsigned int duration;
     unsigned int width;
     unsigned int height;
@@ -618,16 +795,21 @@ _encoder_add(AvifEncoderObject *self, PyObject *args) {
     avifImage *image = self->image;
     avifImage *frame = NULL;
 
+    // Any bytes-like object, which the pixels are read from without copying
     if (!PyArg_ParseTuple(
             args,
-            "z#IIIsO",
-            (char **)&rgb_bytes,
-            &size,
+#if PY_VERSION_HEX >= 0x03000000
+            "y*IIIsO|I",
+#else
+            "s*IIIsO|I",
+#endif
+            &buffer,
             &duration,
             &width,
             &height,
             &mode,
-            &is_single_frame)) {
+            &is_single_frame,
+            &row_bytes)) {
         return NULL;
     }
 
@@ -639,6 +821,7 @@ _encoder_add(AvifEncoderObject *self, PyObject *args) {
             image->height,
             width,
             height);
+        PyBuffer_Release(&buffer);
         return NULL;
     }
 
@@ -648,8 +831,9 @@ _encoder_add(AvifEncoderObject *self, PyObject *args) {
         frame = image;
     } else {
         frame = avifImageCreateEmpty();
-        if (image == NULL) {
+        if (frame == NULL) {
             PyErr_SetString(PyExc_ValueError, "Image creation failed");
+            PyBuffer_Release(&buffer);
             return NULL;
         }
 
@@ -674,34 +858,38 @@ _encoder_add(AvifEncoderObject *self, PyObject *args) {
         rgb.format = AVIF_RGB_FORMAT_RGB;
     }
 
-#if AVIF_VERSION < 1000000
-    avifRGBImageAllocatePixels(&rgb);
-#else
-    result = avifRGBImageAllocatePixels(&rgb);
-    if (result != AVIF_RESULT_OK) {
-        PyErr_Format(
-            exc_type_for_avif_result(result),
-            "Pixel allocation failed: %s",
-            avifResultToString(result));
-        error = 1;
-        goto end;
+    // The rows of pixels can be further apart than their size, such as when
+    // they are padded
+    rgb.rowBytes = rgb.width * avifRGBImagePixelSize(&rgb);
+    if (row_bytes != 0) {
+        if (row_bytes < rgb.rowBytes) {
+            PyErr_Format(
+                PyExc_ValueError,
+                "row size %u is less than the size of a row of pixels, %u",
+                row_bytes,
+                rgb.rowBytes);
+            error = 1;
+            goto end;
+        }
+        rgb.rowBytes = row_bytes;
     }
-#endif
 
-    if (rgb.rowBytes * rgb.height != size) {
+    if (rgb.height != 0 && (Py_ssize_t)rgb.rowBytes * (rgb.height - 1) +
+                                   rgb.width * avifRGBImagePixelSize(&rgb) >
+                               buffer.len) {
         PyErr_Format(
             PyExc_RuntimeError,
-            "rgb data has incorrect size: %u * %u (%u) != %u",
+            "rgb data has incorrect size: %u * %u (%u) > %zd",
             rgb.rowBytes,
             rgb.height,
             rgb.rowBytes * rgb.height,
-            size);
+            buffer.len);
         error = 1;
         goto end;
     }
 
-    // rgb.pixels is safe for writes
-    memcpy(rgb.pixels, rgb_bytes, size);
+    // The conversion only reads the pixels
+    rgb.pixels = (uint8_t *)buffer.buf;
 
     Py_BEGIN_ALLOW_THREADS;
     result = avifImageRGBToYUV(frame, &rgb);
@@ -720,9 +908,19 @@ _encoder_add(AvifEncoderObject *self, PyObject *args) {
                                  ? AVIF_ADD_IMAGE_FLAG_SINGLE
                                  : AVIF_ADD_IMAGE_FLAG_NONE;
 
-    Py_BEGIN_ALLOW_THREADS;
-    result = avifEncoderAddImage(encoder, frame, duration, addImageFlags);
-    Py_END_ALLOW_THREADS;
+    // Once the previous frame is done, hand this one over to the worker
+    // thread, so that the caller can prepare the next frame meanwhile
+    result = _encoder_wait(self);
+    if (result == AVIF_RESULT_OK) {
+        if (self->pipeline_done != NULL &&
+            _encoder_submit(self, frame, duration, addImageFlags)) {
+            frame = NULL;
+        } else {
+            Py_BEGIN_ALLOW_THREADS;
+            result = avifEncoderAddImage(encoder, frame, duration, addImageFlags);
+            Py_END_ALLOW_THREADS;
+        }
+    }
 
     if (result != AVIF_RESULT_OK) {
         PyErr_Format(
@@ -734,10 +932,8 @@ _encoder_add(AvifEncoderObject *self, PyObject *args) {
     }
 
 end:
-    if (&rgb) {
-        avifRGBImageFreePixels(&rgb);
-    }
-    if (!self->first_frame) {
+    PyBuffer_Release(&buffer);
+    if (frame != NULL && frame != image) {
         avifImageDestroy(frame);
     }
 
@@ -756,6 +952,15 @@ _encoder_finish(AvifEncoderObject *self) {
     avifResult result;
     PyObject *ret = NULL;
 
+    result = _encoder_stop_pipeline(self);
+    if (result != AVIF_RESULT_OK) {
+        PyErr_Format(
+            exc_type_for_avif_result(result),
+            "Failed to encode image: %s",
+            avifResultToString(result));
+        return NULL;
+    }
+
     Py_BEGIN_ALLOW_THREADS;
     result = avifEncoderFinish(encoder, &raw);
     Py_END_ALLOW_THREADS;
@@ -769,45 +974,303 @@ _encoder_finish(AvifEncoderObject *self) {
         return NULL;
     }
 
+#if PY_VERSION_HEX >= 0x03000000
+    AvifDataObject *data = PyObject_New(AvifDataObject, &AvifData_Type);
+    if (data == NULL) {
+        avifRWDataFree(&raw);
+        return NULL;
+    }
+    data->raw = raw;
+    ret = (PyObject *)data;
+#else
     ret = PyBytes_FromStringAndSize((char *)raw.data, raw.size);
 
     avifRWDataFree(&raw);
+#endif
 
     return ret;
 }
 
+#if PY_VERSION_HEX >= 0x03000000
+static void
+_data_dealloc(AvifDataObject *self) {
+    avifRWDataFree(&self->raw);
+    PyObject_Del(self);
+}
+
+static int
+_data_getbuffer(AvifDataObject *self, Py_buffer *view, int flags) {
+    return PyBuffer_FillInfo(
+        view, (PyObject *)self, self->raw.data, (Py_ssize_t)self->raw.size, 1, flags);
+}
+
+static Py_ssize_t
+_data_length(AvifDataObject *self) {
+    return (Py_ssize_t)self->raw.size;
+}
+#endif
+
+// Python file object IO functions
+static void
+_pyfile_io_destroy(avifIO *io) {
+    avifPyFileIO *pyio = (avifPyFileIO *)io;
+    Py_XDECREF(pyio->fp);
+    PyMem_Free(pyio->buffer);
+    PyMem_Free(pyio);
+}
+
+static avifResult
+_pyfile_io_read(
+    avifIO *io, uint32_t readFlags, uint64_t offset, size_t size, avifROData *out) {
+    avifPyFileIO *pyio = (avifPyFileIO *)io;
+    avifResult result = AVIF_RESULT_OK;
+    PyObject *ret = NULL;
+    char *data;
+    Py_ssize_t len;
+
+    if (readFlags != 0) {
+        // Unsupported readFlags
+        return AVIF_RESULT_IO_ERROR;
+    }
+    if (offset > io->sizeHint) {
+        // The offset is past the end of the file
+        return AVIF_RESULT_IO_ERROR;
+    }
+    if (size > io->sizeHint - offset) {
+        size = (size_t)(io->sizeHint - offset);
+    }
+    out->data = pyio->buffer;
+    out->size = 0;
+    if (size == 0) {
+        return AVIF_RESULT_OK;
+    }
+
+    // libavif may call this with the GIL released
+    PyGILState_STATE gstate = PyGILState_Ensure();
+
+    ret =
+        PyObject_CallMethod(pyio->fp, "seek", "L", pyio->start + (PY_LONG_LONG)offset);
+    if (ret == NULL) {
+        result = AVIF_RESULT_IO_ERROR;
+        goto end;
+    }
+    Py_DECREF(ret);
+
+    ret = PyObject_CallMethod(pyio->fp, "read", "n", (Py_ssize_t)size);
+    if (ret == NULL || PyBytes_AsStringAndSize(ret, &data, &len) < 0) {
+        result = AVIF_RESULT_IO_ERROR;
+        goto end;
+    }
+    if ((size_t)len > size) {
+        PyErr_SetString(PyExc_OSError, "read() returned too much data");
+        result = AVIF_RESULT_IO_ERROR;
+        goto end;
+    }
+
+    if ((size_t)len > pyio->buffer_size) {
+        uint8_t *buffer = PyMem_Realloc(pyio->buffer, len);
+        if (buffer == NULL) {
+            PyErr_NoMemory();
+            result = AVIF_RESULT_IO_ERROR;
+            goto end;
+        }
+        pyio->buffer = buffer;
+        pyio->buffer_size = len;
+    }
+    memcpy(pyio->buffer, data, len);
+    out->data = pyio->buffer;
+    out->size = len;
+
+end:
+    Py_XDECREF(ret);
+    PyGILState_Release(gstate);
+    return result;
+}
+
+static avifIO *
+_pyfile_io_create(PyObject *fp) {
+    avifPyFileIO *pyio = NULL;
+    PyObject *ret = NULL;
+    PY_LONG_LONG start, end;
+
+    ret = PyObject_CallMethod(fp, "tell", NULL);
+    if (ret == NULL) {
+        return NULL;
+    }
+    start = PyLong_AsLongLong(ret);
+    Py_DECREF(ret);
+    if (start == -1 && PyErr_Occurred()) {
+        return NULL;
+    }
+
+    ret = PyObject_CallMethod(fp, "seek", "ii", 0, 2);
+    if (ret == NULL) {
+        return NULL;
+    }
+    Py_DECREF(ret);
+    ret = PyObject_CallMethod(fp, "tell", NULL);
+    if (ret == NULL) {
+        return NULL;
+    }
+    end = PyLong_AsLongLong(ret);
+    Py_DECREF(ret);
+    if (end == -1 && PyErr_Occurred()) {
+        return NULL;
+    }
+    if (end < start) {
+        PyErr_SetString(PyExc_OSError, "could not determine file size");
+        return NULL;
+    }
+
+    pyio = PyMem_Malloc(sizeof(avifPyFileIO));
+    if (pyio == NULL) {
+        PyErr_NoMemory();
+        return NULL;
+    }
+    memset(pyio, 0, sizeof(avifPyFileIO));
+    pyio->io.destroy = _pyfile_io_destroy;
+    pyio->io.read = _pyfile_io_read;
+    pyio->io.sizeHint = (uint64_t)(end - start);
+    pyio->io.persistent = AVIF_FALSE;
+    pyio->start = start;
+    pyio->fp = fp;
+    Py_INCREF(fp);
+
+    return (avifIO *)pyio;
+}
+
 // Decoder functions
+static int
+_decoder_source_from_string(const char *source_str, avifDecoderSource *source) {
+    if (strcmp(source_str, "auto") == 0) {
+        *source = AVIF_DECODER_SOURCE_AUTO;
+    } else if (strcmp(source_str, "primary") == 0) {
+        *source = AVIF_DECODER_SOURCE_PRIMARY_ITEM;
+    } else if (strcmp(source_str, "tracks") == 0) {
+        *source = AVIF_DECODER_SOURCE_TRACKS;
+    } else {
+        PyErr_Format(PyExc_ValueError, "Invalid source: %s", source_str);
+        return 0;
+    }
+    return 1;
+}
+
+static int
+_decoder_upsampling_from_string(
+    const char *upsampling_str, avifChromaUpsampling *upsampling) {
+    if (!strcmp(upsampling_str, "auto")) {
+        *upsampling = AVIF_CHROMA_UPSAMPLING_AUTOMATIC;
+    } else if (!strcmp(upsampling_str, "fastest")) {
+        *upsampling = AVIF_CHROMA_UPSAMPLING_FASTEST;
+    } else if (!strcmp(upsampling_str, "best")) {
+        *upsampling = AVIF_CHROMA_UPSAMPLING_BEST_QUALITY;
+    } else if (!strcmp(upsampling_str, "nearest")) {
+        *upsampling = AVIF_CHROMA_UPSAMPLING_NEAREST;
+    } else if (!strcmp(upsampling_str, "bilinear")) {
+        *upsampling = AVIF_CHROMA_UPSAMPLING_BILINEAR;
+    } else {
+        PyErr_Format(PyExc_ValueError, "Invalid upsampling option: %s", upsampling_str);
+        return 0;
+    }
+    return 1;
+}
+
+// Sets the limits on the number of pixels, width or height, and number of
+// frames of an image, which libavif checks while parsing the file, before
+// anything is decoded. A limit of 0 keeps libavif's default.
+static void
+_decoder_set_limits(
+    avifDecoder *decoder,
+    uint32_t size_limit,
+    uint32_t dimension_limit,
+    uint32_t count_limit) {
+#if AVIF_VERSION >= 90300
+    if (size_limit) {
+        // libavif doesn't allow raising the default limit
+        decoder->imageSizeLimit = size_limit < AVIF_DEFAULT_IMAGE_SIZE_LIMIT
+                                      ? size_limit
+                                      : AVIF_DEFAULT_IMAGE_SIZE_LIMIT;
+    }
+    if (count_limit) {
+        decoder->imageCountLimit = count_limit;
+    }
+#else
+    (void)size_limit;
+    (void)count_limit;
+#endif
+#if AVIF_VERSION >= 1000000
+    if (dimension_limit) {
+        decoder->imageDimensionLimit = dimension_limit;
+    }
+#else
+    (void)dimension_limit;
+#endif
+}
+
 PyObject *
 AvifDecoderNew(PyObject *self_, PyObject *args) {
-    PyObject *avif_bytes;
+    PyObject *avif_data;
     AvifDecoderObject *self = NULL;
     avifDecoder *decoder;
+    avifIO *io = NULL;
 
     char *upsampling_str;
     char *codec_str;
     avifCodecChoice codec;
     avifChromaUpsampling upsampling;
     int max_threads = 0;
+    PyObject *ignore_exif = Py_False;
+    PyObject *ignore_xmp = Py_False;
+    PyObject *ignore_icc = Py_False;
+    PyObject *ignore_alpha = Py_False;
+    char *source_str = "auto";
+    avifDecoderSource source;
+    uint32_t size_limit = 0;
+    uint32_t dimension_limit = 0;
+    uint32_t count_limit = 0;
 
     avifResult result;
 
     if (!PyArg_ParseTuple(
-            args, "Sssi", &avif_bytes, &codec_str, &upsampling_str, &max_threads)) {
+            args,
+            "Ossi|OOOOsIII",
+            &avif_data,
+            &codec_str,
+            &upsampling_str,
+            &max_threads,
+            &ignore_exif,
+            &ignore_xmp,
+            &ignore_icc,
+            &ignore_alpha,
+            &source_str,
+            &size_limit,
+            &dimension_limit,
+            &count_limit)) {
         return NULL;
     }
 
-    if (!strcmp(upsampling_str, "auto")) {
-        upsampling = AVIF_CHROMA_UPSAMPLING_AUTOMATIC;
-    } else if (!strcmp(upsampling_str, "fastest")) {
-        upsampling = AVIF_CHROMA_UPSAMPLING_FASTEST;
-    } else if (!strcmp(upsampling_str, "best")) {
-        upsampling = AVIF_CHROMA_UPSAMPLING_BEST_QUALITY;
-    } else if (!strcmp(upsampling_str, "nearest")) {
-        upsampling = AVIF_CHROMA_UPSAMPLING_NEAREST;
-    } else if (!strcmp(upsampling_str, "bilinear")) {
-        upsampling = AVIF_CHROMA_UPSAMPLING_BILINEAR;
-    } else {
-        PyErr_Format(PyExc_ValueError, "Invalid upsampling option: %s", upsampling_str);
+    if (!_decoder_source_from_string(source_str, &source)) {
+        return NULL;
+    }
+
+    if (!PyObject_CheckBuffer(avif_data)) {
+        if (!PyObject_HasAttrString(avif_data, "read") ||
+            !PyObject_HasAttrString(avif_data, "seek")) {
+            PyErr_SetString(
+                PyExc_TypeError,
+                "expected a bytes-like object or a seekable file object");
+            return NULL;
+        }
+        io = _pyfile_io_create(avif_data);
+        if (io == NULL) {
+            return NULL;
+        }
+    }
+
+    if (!_decoder_upsampling_from_string(upsampling_str, &upsampling)) {
+        if (io) {
+            io->destroy(io);
+        }
         return NULL;
     }
 
@@ -820,14 +1283,40 @@ AvifDecoderNew(PyObject *self_, PyObject *args) {
     self = PyObject_New(AvifDecoderObject, &AvifDecoder_Type);
     if (!self) {
         PyErr_SetString(PyExc_RuntimeError, "could not create decoder object");
+        if (io) {
+            io->destroy(io);
+        }
         return NULL;
     }
 
     self->upsampling = upsampling;
+    self->buffer.obj = NULL;
+    self->lock = NULL;
+    self->keyframes = NULL;
+    self->scaled_width = 0;
+    self->scaled_height = 0;
+    self->ignore_exif = PyObject_IsTrue(ignore_exif) == 1;
+    self->ignore_xmp = PyObject_IsTrue(ignore_xmp) == 1;
+    self->ignore_icc = PyObject_IsTrue(ignore_icc) == 1;
+    self->ignore_alpha = PyObject_IsTrue(ignore_alpha) == 1;
+
+    // Hold on to the buffer (without copying it) for the decoder's lifetime
+    if (!io && PyObject_GetBuffer(avif_data, &self->buffer, PyBUF_SIMPLE) < 0) {
+        PyObject_Del(self);
+        return NULL;
+    }
 
-    decoder = avifDecoderCreate();
+    self->lock = PyThread_allocate_lock();
+    decoder = self->lock ? avifDecoderCreate() : NULL;
     if (!decoder) {
         PyErr_SetString(PyExc_MemoryError, "Can't allocate decoder");
+        if (self->lock) {
+            PyThread_free_lock(self->lock);
+        }
+        if (io) {
+            io->destroy(io);
+        }
+        PyBuffer_Release(&self->buffer);
         PyObject_Del(self);
         return NULL;
     }
@@ -848,41 +1337,67 @@ AvifDecoderNew(PyObject *self_, PyObject *args) {
     // items. libheif v1.11.0 and older does not add the 'pixi' item property to
     // AV1 image items.
     decoder->strictFlags &= ~AVIF_STRICT_PIXI_REQUIRED;
+#endif
+#if AVIF_VERSION >= 90000
+    // Don't keep a copy of metadata that won't be returned
+    decoder->ignoreExif = self->ignore_exif ? AVIF_TRUE : AVIF_FALSE;
+    decoder->ignoreXMP = self->ignore_xmp ? AVIF_TRUE : AVIF_FALSE;
 #endif
     decoder->codecChoice = codec;
+    decoder->requestedSource = source;
+    _decoder_set_limits(decoder, size_limit, dimension_limit, count_limit);
 
-    Py_INCREF(avif_bytes);
-
-    result = avifDecoderSetIOMemory(
-        decoder,
-        (uint8_t *)PyBytes_AS_STRING(avif_bytes),
-        PyBytes_GET_SIZE(avif_bytes));
+    if (io) {
+        // The decoder takes ownership of io
+        avifDecoderSetIO(decoder, io);
+    } else {
+        result = avifDecoderSetIOMemory(
+            decoder, (uint8_t *)self->buffer.buf, self->buffer.len);
 
-    if (result != AVIF_RESULT_OK) {
-        PyErr_Format(
-            exc_type_for_avif_result(result),
-            "Setting IO memory failed: %s",
-            avifResultToString(result));
-        avifDecoderDestroy(decoder);
-        Py_XDECREF(avif_bytes);
-        PyObject_Del(self);
-        return NULL;
+        if (result != AVIF_RESULT_OK) {
+            PyErr_Format(
+                exc_type_for_avif_result(result),
+                "Setting IO memory failed: %s",
+                avifResultToString(result));
+            avifDecoderDestroy(decoder);
+            PyBuffer_Release(&self->buffer);
+            PyThread_free_lock(self->lock);
+            PyObject_Del(self);
+            return NULL;
+        }
     }
 
+    Py_BEGIN_ALLOW_THREADS;
     result = avifDecoderParse(decoder);
+    Py_END_ALLOW_THREADS;
     if (result != AVIF_RESULT_OK) {
-        PyErr_Format(
-            exc_type_for_avif_result(result),
-            "Failed to decode image: %s",
-            avifResultToString(result));
+        // A failed read from a file object leaves its exception set
+        if (!PyErr_Occurred()) {
+#if AVIF_VERSION >= 90100
+            // Such as which of the limits the file exceeds
+            if (decoder->diag.error[0]) {
+                PyErr_Format(
+                    exc_type_for_avif_result(result),
+                    "Failed to decode image: %s (%s)",
+                    avifResultToString(result),
+                    decoder->diag.error);
+            } else
+#endif
+            {
+                PyErr_Format(
+                    exc_type_for_avif_result(result),
+                    "Failed to decode image: %s",
+                    avifResultToString(result));
+            }
+        }
         avifDecoderDestroy(decoder);
-        Py_XDECREF(avif_bytes);
+        PyBuffer_Release(&self->buffer);
+        PyThread_free_lock(self->lock);
         PyObject_Del(self);
         return NULL;
     }
 
     self->decoder = decoder;
-    self->data = avif_bytes;
 
     return (PyObject *)self;
 }
@@ -892,10 +1407,29 @@ _decoder_dealloc(AvifDecoderObject *self) {
     if (self->decoder) {
         avifDecoderDestroy(self->decoder);
     }
-    Py_XDECREF(self->data);
+    if (self->buffer.obj) {
+        PyBuffer_Release(&self->buffer);
+    }
+    if (self->lock) {
+        PyThread_free_lock(self->lock);
+    }
+    Py_XDECREF(self->keyframes);
     Py_RETURN_NONE;
 }
 
+static int
+_decoder_has_alpha(AvifDecoderObject *self) {
+    return self->decoder->alphaPresent && !self->ignore_alpha;
+}
+
+static const char *
+_decoder_mode(AvifDecoderObject *self) {
+    if (self->decoder->image->yuvFormat == AVIF_PIXEL_FORMAT_YUV400) {
+        return _decoder_has_alpha(self) ? "LA" : "L";
+    }
+    return _decoder_has_alpha(self) ? "RGBA" : "RGB";
+}
+
 PyObject *
 _decoder_get_info(AvifDecoderObject *self) {
     avifDecoder *decoder = self->decoder;
@@ -906,16 +1440,18 @@ _decoder_get_info(AvifDecoderObject *self) {
     PyObject *xmp = NULL;
     PyObject *ret = NULL;
 
-    if (image->xmp.size) {
+    _decoder_lock(self);
+
+    if (image->xmp.size && !self->ignore_xmp) {
         xmp = PyBytes_FromStringAndSize((const char *)image->xmp.data, image->xmp.size);
     }
 
-    if (image->exif.size) {
+    if (image->exif.size && !self->ignore_exif) {
         exif =
             PyBytes_FromStringAndSize((const char *)image->exif.data, image->exif.size);
     }
 
-    if (image->icc.size) {
+    if (image->icc.size && !self->ignore_icc) {
         icc = PyBytes_FromStringAndSize((const char *)image->icc.data, image->icc.size);
     }
 
@@ -924,12 +1460,14 @@ _decoder_get_info(AvifDecoderObject *self) {
         image->width,
         image->height,
         decoder->imageCount,
-        decoder->alphaPresent ? "RGBA" : "RGB",
+        _decoder_mode(self),
         NULL == icc ? Py_None : icc,
         NULL == exif ? Py_None : exif,
         irot_imir_to_exif_orientation(image),
         NULL == xmp ? Py_None : xmp);
 
+    _decoder_unlock(self);
+
     Py_XDECREF(xmp);
     Py_XDECREF(exif);
     Py_XDECREF(icc);
@@ -937,56 +1475,193 @@ _decoder_get_info(AvifDecoderObject *self) {
     return ret;
 }
 
-PyObject *
-_decoder_get_frame(AvifDecoderObject *self, PyObject *args) {
-    PyObject *bytes;
-    PyObject *ret;
-    Py_ssize_t size;
+// Returns the decoded image at the size set with set_scaled_size. If it had
+// to be scaled, *scaled_image is set to the image to destroy afterwards.
+static avifImage *
+_decoder_output_image(AvifDecoderObject *self, avifImage **scaled_image) {
+    avifImage *image = self->decoder->image;
+#if AVIF_VERSION >= 1000000
     avifResult result;
-    avifRGBImage rgb;
-    avifDecoder *decoder;
-    avifImage *image;
-    uint32_t frame_index;
 
-    decoder = self->decoder;
+    if (self->scaled_width &&
+        (self->scaled_width != image->width || self->scaled_height != image->height)) {
+        // Scale a view of the decoded planes, which leaves the decoder's
+        // own image untouched
+        avifCropRect rect = {0, 0, image->width, image->height};
 
-    if (!PyArg_ParseTuple(args, "I", &frame_index)) {
-        return NULL;
+        *scaled_image = avifImageCreateEmpty();
+        if (*scaled_image == NULL) {
+            PyErr_SetString(PyExc_MemoryError, "Failed to create image");
+            return NULL;
+        }
+        result = avifImageSetViewRect(*scaled_image, image, &rect);
+        if (result == AVIF_RESULT_OK) {
+            Py_BEGIN_ALLOW_THREADS;
+            result = avifImageScale(
+                *scaled_image,
+                self->scaled_width,
+                self->scaled_height,
+                &self->decoder->diag);
+            Py_END_ALLOW_THREADS;
+        }
+        if (result != AVIF_RESULT_OK) {
+            PyErr_Format(
+                exc_type_for_avif_result(result),
+                "Failed to scale image: %s",
+                avifResultToString(result));
+            avifImageDestroy(*scaled_image);
+            *scaled_image = NULL;
+            return NULL;
+        }
+        image = *scaled_image;
     }
+#endif
+    return image;
+}
 
-    result = avifDecoderNthImage(decoder, frame_index);
-    if (result != AVIF_RESULT_OK) {
-        PyErr_Format(
-            exc_type_for_avif_result(result),
-            "Failed to decode frame %u: %s",
-            frame_index,
-            avifResultToString(result));
-        return NULL;
+// Maps each sample value of the given depth to 0-max_value, stretching
+// limited range values to full range.
+static void
+_build_gray_lut(uint16_t *lut, uint32_t depth, int limited_range, uint32_t max_value) {
+    uint32_t max = (1u << depth) - 1;
+    uint32_t low = 0, high = max, v;
+
+    if (limited_range) {
+        low = 16u << (depth - 8);
+        high = 235u << (depth - 8);
+    }
+    for (v = 0; v <= max; v++) {
+        if (v <= low) {
+            lut[v] = 0;
+        } else if (v >= high) {
+            lut[v] = (uint16_t)max_value;
+        } else {
+            lut[v] =
+                (uint16_t)(((v - low) * max_value + (high - low) / 2) / (high - low));
+        }
     }
+}
 
-    image = decoder->image;
+// Writes the luma (and alpha) planes of a 4:0:0 image as L or LA pixels, or
+// as little endian 16-bit samples for a depth of 16, without going through
+// RGB.
+static avifResult
+_image_to_gray(
+    const avifImage *image, int with_alpha, uint32_t depth, uint8_t *pixels) {
+    uint16_t *luma_lut, *alpha_lut;
+    uint32_t x, y, max_value = (1u << depth) - 1;
+    uint32_t channels = with_alpha ? 2 : 1, bytes_per_sample = depth / 8;
+    size_t lut_size = (size_t)1 << image->depth;
+    int u16 = image->depth > 8, premultiplied = 0;
+
+#if AVIF_VERSION >= 90000
+    premultiplied = with_alpha && image->alphaPremultiplied;
+#endif
+
+    luma_lut = malloc(lut_size * 2 * sizeof(uint16_t));
+    if (luma_lut == NULL) {
+        return AVIF_RESULT_OUT_OF_MEMORY;
+    }
+    alpha_lut = luma_lut + lut_size;
+    _build_gray_lut(
+        luma_lut, image->depth, image->yuvRange == AVIF_RANGE_LIMITED, max_value);
+    _build_gray_lut(alpha_lut, image->depth, 0, max_value);
+
+    for (y = 0; y < image->height; y++) {
+        const uint8_t *luma_row =
+            image->yuvPlanes[AVIF_CHAN_Y] + (size_t)y * image->yuvRowBytes[AVIF_CHAN_Y];
+        const uint8_t *alpha_row =
+            with_alpha ? image->alphaPlane + (size_t)y * image->alphaRowBytes : NULL;
+        uint8_t *dst = pixels + (size_t)y * image->width * channels * bytes_per_sample;
+
+        for (x = 0; x < image->width; x++) {
+            uint32_t l = luma_lut[u16 ? ((const uint16_t *)luma_row)[x] : luma_row[x]];
+            uint32_t a = max_value;
+            if (with_alpha) {
+                a = alpha_lut[u16 ? ((const uint16_t *)alpha_row)[x] : alpha_row[x]];
+                if (premultiplied) {
+                    l = a ? (l >= a ? max_value : (l * max_value + a / 2) / a) : 0;
+                }
+            }
+            if (bytes_per_sample == 1) {
+                *dst++ = (uint8_t)l;
+                if (with_alpha) {
+                    *dst++ = (uint8_t)a;
+                }
+            } else {
+                *dst++ = (uint8_t)(l & 0xff);
+                *dst++ = (uint8_t)(l >> 8);
+                if (with_alpha) {
+                    *dst++ = (uint8_t)(a & 0xff);
+                    *dst++ = (uint8_t)(a >> 8);
+                }
+            }
+        }
+    }
+
+    free(luma_lut);
+    return AVIF_RESULT_OK;
+}
+
+// Converts the decoder's current image to RGB(A), or L(A) for 4:0:0 images,
+// with 8 or 16 bits per sample. The decoder lock must be held.
+static PyObject *
+_decoder_image_to_frame(AvifDecoderObject *self, uint32_t depth) {
+    PyObject *buffer = NULL;
+    PyObject *ret = NULL;
+    avifResult result;
+    avifRGBImage rgb;
+    avifDecoder *decoder = self->decoder;
+    avifImage *scaled_image = NULL;
+    avifImage *image = _decoder_output_image(self, &scaled_image);
+    int gray;
+
+    if (image == NULL) {
+        return NULL;
+    }
 
     avifRGBImageSetDefaults(&rgb, image);
 
-    rgb.depth = 8;
-    rgb.format = decoder->alphaPresent ? AVIF_RGB_FORMAT_RGBA : AVIF_RGB_FORMAT_RGB;
+    rgb.depth = depth;
+    rgb.format = _decoder_has_alpha(self) ? AVIF_RGB_FORMAT_RGBA : AVIF_RGB_FORMAT_RGB;
     rgb.chromaUpsampling = self->upsampling;
+    rgb.rowBytes = rgb.width * avifRGBImagePixelSize(&rgb);
 
-#if AVIF_VERSION < 1000000
-    avifRGBImageAllocatePixels(&rgb);
-#else
-    result = avifRGBImageAllocatePixels(&rgb);
-    if (result != AVIF_RESULT_OK) {
-        PyErr_Format(
-            exc_type_for_avif_result(result),
-            "Pixel allocation failed: %s",
-            avifResultToString(result));
-        return NULL;
+    gray = image->yuvFormat == AVIF_PIXEL_FORMAT_YUV400;
+    if (gray) {
+        rgb.rowBytes = rgb.width * (_decoder_has_alpha(self) ? 2 : 1) * (depth / 8);
     }
-#endif
+
+    if (rgb.height > PY_SSIZE_T_MAX / rgb.rowBytes) {
+        PyErr_SetString(PyExc_MemoryError, "Integer overflow in pixel size");
+        goto end;
+    }
+
+    // Convert directly into the buffer that is returned, so that it can be
+    // used as the image memory without any further copies
+    buffer = PyByteArray_FromStringAndSize(NULL, (Py_ssize_t)rgb.rowBytes * rgb.height);
+    if (buffer == NULL) {
+        goto end;
+    }
+    rgb.pixels = (uint8_t *)PyByteArray_AS_STRING(buffer);
 
     Py_BEGIN_ALLOW_THREADS;
-    result = avifImageYUVToRGB(image, &rgb);
+    if (gray) {
+        result = _image_to_gray(image, _decoder_has_alpha(self), depth, rgb.pixels);
+    } else {
+        result = avifImageYUVToRGB(image, &rgb);
+#if PY_BIG_ENDIAN
+        if (result == AVIF_RESULT_OK && depth == 16) {
+            // Return little endian samples, as for 4:0:0 images
+            uint8_t *p = rgb.pixels, *p_end = p + (size_t)rgb.rowBytes * rgb.height;
+            for (; p < p_end; p += 2) {
+                uint8_t tmp = p[0];
+                p[0] = p[1];
+                p[1] = tmp;
+            }
+        }
+#endif
+    }
     Py_END_ALLOW_THREADS;
 
     if (result != AVIF_RESULT_OK) {
@@ -994,28 +1669,815 @@ _decoder_get_frame(AvifDecoderObject *self, PyObject *args) {
             exc_type_for_avif_result(result),
             "Conversion from YUV failed: %s",
             avifResultToString(result));
-        avifRGBImageFreePixels(&rgb);
+        goto end;
+    }
+
+    ret = Py_BuildValue(
+        "OKKK",
+        buffer,
+        (unsigned PY_LONG_LONG)decoder->timescale,
+        (unsigned PY_LONG_LONG)decoder->imageTiming.ptsInTimescales,
+        (unsigned PY_LONG_LONG)decoder->imageTiming.durationInTimescales);
+
+end:
+    if (scaled_image) {
+        avifImageDestroy(scaled_image);
+    }
+    Py_XDECREF(buffer);
+
+    return ret;
+}
+
+PyObject *
+_decoder_get_frame(AvifDecoderObject *self, PyObject *args) {
+    PyObject *ret = NULL;
+    avifResult result;
+    uint32_t frame_index;
+    uint32_t depth = 8;
+
+    if (!PyArg_ParseTuple(args, "I|I", &frame_index, &depth)) {
+        return NULL;
+    }
+    if (depth != 8 && depth != 16) {
+        PyErr_SetString(PyExc_ValueError, "depth must be 8 or 16");
         return NULL;
     }
 
-    if (rgb.height > PY_SSIZE_T_MAX / rgb.rowBytes) {
-        PyErr_SetString(PyExc_MemoryError, "Integer overflow in pixel size");
+    _decoder_lock(self);
+
+    Py_BEGIN_ALLOW_THREADS;
+    result = avifDecoderNthImage(self->decoder, frame_index);
+    Py_END_ALLOW_THREADS;
+
+    if (result != AVIF_RESULT_OK) {
+        if (!PyErr_Occurred()) {
+            PyErr_Format(
+                exc_type_for_avif_result(result),
+                "Failed to decode frame %u: %s",
+                frame_index,
+                avifResultToString(result));
+        }
+    } else {
+        ret = _decoder_image_to_frame(self, depth);
+    }
+
+    _decoder_unlock(self);
+
+    return ret;
+}
+
+// Iterating over the decoder returns the frames after the last decoded one
+// (from the first frame, for a new decoder) without seeking.
+PyObject *
+_decoder_iternext(AvifDecoderObject *self) {
+    PyObject *ret = NULL;
+    avifResult result;
+
+    _decoder_lock(self);
+
+    Py_BEGIN_ALLOW_THREADS;
+    result = avifDecoderNextImage(self->decoder);
+    Py_END_ALLOW_THREADS;
+
+    if (result == AVIF_RESULT_NO_IMAGES_REMAINING) {
+        // Raises StopIteration
+    } else if (result != AVIF_RESULT_OK) {
+        if (!PyErr_Occurred()) {
+            PyErr_Format(
+                exc_type_for_avif_result(result),
+                "Failed to decode frame %d: %s",
+                self->decoder->imageIndex + 1,
+                avifResultToString(result));
+        }
+    } else {
+        ret = _decoder_image_to_frame(self, 8);
+    }
+
+    _decoder_unlock(self);
+
+    return ret;
+}
+
+static const char *
+_subsampling_to_string(avifPixelFormat format) {
+    switch (format) {
+        case AVIF_PIXEL_FORMAT_YUV444:
+            return "4:4:4";
+        case AVIF_PIXEL_FORMAT_YUV422:
+            return "4:2:2";
+        case AVIF_PIXEL_FORMAT_YUV420:
+            return "4:2:0";
+        case AVIF_PIXEL_FORMAT_YUV400:
+            return "4:0:0";
+        default:
+            return "unknown";
+    }
+}
+
+// Copies the planes of the decoder's current image without converting them.
+// The decoder lock must be held.
+static PyObject *
+_decoder_image_to_yuv_frame(AvifDecoderObject *self) {
+    PyObject *planes = NULL;
+    PyObject *strides = NULL;
+    PyObject *ret = NULL;
+    avifDecoder *decoder = self->decoder;
+    avifImage *scaled_image = NULL;
+    avifImage *image = _decoder_output_image(self, &scaled_image);
+    uint32_t bytes_per_sample, shift_x, shift_y, c, y;
+
+    if (image == NULL) {
         return NULL;
     }
 
-    size = rgb.rowBytes * rgb.height;
+    bytes_per_sample = image->depth > 8 ? 2 : 1;
+    shift_x = image->yuvFormat == AVIF_PIXEL_FORMAT_YUV444 ? 0 : 1;
+    shift_y = image->yuvFormat == AVIF_PIXEL_FORMAT_YUV420 ? 1 : 0;
 
-    bytes = PyBytes_FromStringAndSize((char *)rgb.pixels, size);
-    avifRGBImageFreePixels(&rgb);
+    planes = PyTuple_New(4);
+    strides = PyTuple_New(4);
+    if (planes == NULL || strides == NULL) {
+        goto end;
+    }
+
+    for (c = 0; c < 4; c++) {
+        PyObject *plane, *stride;
+        uint8_t *src, *dst;
+        uint32_t src_stride, width, height;
+
+        if (c == AVIF_CHAN_A) {
+            src = _decoder_has_alpha(self) ? image->alphaPlane : NULL;
+            src_stride = image->alphaRowBytes;
+        } else if (c != AVIF_CHAN_Y && image->yuvFormat == AVIF_PIXEL_FORMAT_YUV400) {
+            src = NULL;
+            src_stride = 0;
+        } else {
+            src = image->yuvPlanes[c];
+            src_stride = image->yuvRowBytes[c];
+        }
+        if (src == NULL) {
+            Py_INCREF(Py_None);
+            PyTuple_SET_ITEM(planes, c, Py_None);
+            Py_INCREF(Py_None);
+            PyTuple_SET_ITEM(strides, c, Py_None);
+            continue;
+        }
+
+        width = image->width;
+        height = image->height;
+        if (c == AVIF_CHAN_U || c == AVIF_CHAN_V) {
+            width = (width + shift_x) >> shift_x;
+            height = (height + shift_y) >> shift_y;
+        }
+
+        // Copy into a tightly packed buffer, as the decoder reuses its planes
+        plane = PyByteArray_FromStringAndSize(
+            NULL, (Py_ssize_t)width * bytes_per_sample * height);
+        if (plane == NULL) {
+            goto end;
+        }
+        PyTuple_SET_ITEM(planes, c, plane);
+        stride = Py_BuildValue("I", width * bytes_per_sample);
+        if (stride == NULL) {
+            goto end;
+        }
+        PyTuple_SET_ITEM(strides, c, stride);
+
+        dst = (uint8_t *)PyByteArray_AS_STRING(plane);
+        for (y = 0; y < height; y++) {
+            memcpy(dst, src, width * bytes_per_sample);
+            dst += width * bytes_per_sample;
+            src += src_stride;
+        }
+    }
 
     ret = Py_BuildValue(
-        "SKKK",
-        bytes,
+        "OOKKK",
+        planes,
+        strides,
         (unsigned PY_LONG_LONG)decoder->timescale,
         (unsigned PY_LONG_LONG)decoder->imageTiming.ptsInTimescales,
         (unsigned PY_LONG_LONG)decoder->imageTiming.durationInTimescales);
 
-    Py_DECREF(bytes);
+end:
+    if (scaled_image) {
+        avifImageDestroy(scaled_image);
+    }
+    Py_XDECREF(planes);
+    Py_XDECREF(strides);
+
+    return ret;
+}
+
+PyObject *
+_decoder_get_yuv_frame(AvifDecoderObject *self, PyObject *args) {
+    PyObject *ret = NULL;
+    avifResult result;
+    uint32_t frame_index;
+
+    if (!PyArg_ParseTuple(args, "I", &frame_index)) {
+        return NULL;
+    }
+
+    _decoder_lock(self);
+
+    Py_BEGIN_ALLOW_THREADS;
+    result = avifDecoderNthImage(self->decoder, frame_index);
+    Py_END_ALLOW_THREADS;
+
+    if (result != AVIF_RESULT_OK) {
+        if (!PyErr_Occurred()) {
+            PyErr_Format(
+                exc_type_for_avif_result(result),
+                "Failed to decode frame %u: %s",
+                frame_index,
+                avifResultToString(result));
+        }
+    } else {
+        ret = _decoder_image_to_yuv_frame(self);
+    }
+
+    _decoder_unlock(self);
+
+    return ret;
+}
+
+PyObject *
+_decoder_get_yuv_info(AvifDecoderObject *self) {
+    PyObject *ret;
+    avifImage *image;
+
+    _decoder_lock(self);
+
+    image = self->decoder->image;
+    ret = Py_BuildValue(
+        "IssIO",
+        image->depth,
+        _subsampling_to_string(image->yuvFormat),
+        image->yuvRange == AVIF_RANGE_FULL ? "full" : "limited",
+        (unsigned int)image->matrixCoefficients,
+        _decoder_has_alpha(self) ? Py_True : Py_False);
+
+    _decoder_unlock(self);
+
+    return ret;
+}
+
+PyObject *
+_decoder_get_timings(AvifDecoderObject *self) {
+#if AVIF_VERSION >= 90100
+    PyObject *timings = NULL;
+    PyObject *ret = NULL;
+    avifDecoder *decoder = self->decoder;
+    avifImageTiming timing;
+    avifResult result;
+    int repetition_count = -2;
+    uint32_t i;
+
+    _decoder_lock(self);
+
+    timings = PyTuple_New(decoder->imageCount);
+    if (timings == NULL) {
+        goto end;
+    }
+    for (i = 0; i < (uint32_t)decoder->imageCount; i++) {
+        PyObject *item;
+
+        result = avifDecoderNthImageTiming(decoder, i, &timing);
+        if (result != AVIF_RESULT_OK) {
+            PyErr_Format(
+                exc_type_for_avif_result(result),
+                "Failed to get timing of frame %u: %s",
+                i,
+                avifResultToString(result));
+            goto end;
+        }
+        item = Py_BuildValue(
+            "KK",
+            (unsigned PY_LONG_LONG)timing.ptsInTimescales,
+            (unsigned PY_LONG_LONG)timing.durationInTimescales);
+        if (item == NULL) {
+            goto end;
+        }
+        PyTuple_SET_ITEM(timings, i, item);
+    }
+
+#if AVIF_VERSION >= 1000000
+    repetition_count = decoder->repetitionCount;
+#endif
+    ret = Py_BuildValue(
+        "KiO", (unsigned PY_LONG_LONG)decoder->timescale, repetition_count, timings);
+
+end:
+    _decoder_unlock(self);
+    Py_XDECREF(timings);
+    return ret;
+#else
+    PyErr_SetString(
+        PyExc_NotImplementedError, "Frame timings require libavif 0.9.1 or later");
+    return NULL;
+#endif
+}
+
+PyObject *
+_decoder_set_source(AvifDecoderObject *self, PyObject *args) {
+    char *source_str;
+    avifDecoderSource source, previous_source;
+    avifResult result;
+
+    if (!PyArg_ParseTuple(args, "s", &source_str)) {
+        return NULL;
+    }
+    if (!_decoder_source_from_string(source_str, &source)) {
+        return NULL;
+    }
+
+    _decoder_lock(self);
+
+    // Choosing the source again doesn't parse the file again
+    previous_source = self->decoder->requestedSource;
+    self->decoder->requestedSource = source;
+    result = avifDecoderReset(self->decoder);
+    if (result != AVIF_RESULT_OK && !PyErr_Occurred()) {
+        // The file has no such source, so keep using the previous one
+        self->decoder->requestedSource = previous_source;
+        result = avifDecoderReset(self->decoder);
+        if (result == AVIF_RESULT_OK) {
+            _decoder_unlock(self);
+            Py_RETURN_FALSE;
+        }
+    }
+    Py_CLEAR(self->keyframes);
+
+    _decoder_unlock(self);
+
+    if (result != AVIF_RESULT_OK) {
+        if (!PyErr_Occurred()) {
+            PyErr_Format(
+                exc_type_for_avif_result(result),
+                "Failed to reset decoder: %s",
+                avifResultToString(result));
+        }
+        return NULL;
+    }
+    Py_RETURN_TRUE;
+}
+
+PyObject *
+_decoder_set_scaled_size(AvifDecoderObject *self, PyObject *args) {
+    uint32_t width, height;
+
+    if (!PyArg_ParseTuple(args, "(II)", &width, &height)) {
+        return NULL;
+    }
+
+#if AVIF_VERSION >= 1000000
+    if ((width == 0) != (height == 0)) {
+        PyErr_SetString(PyExc_ValueError, "Invalid scaled size");
+        return NULL;
+    }
+    _decoder_lock(self);
+    self->scaled_width = width;
+    self->scaled_height = height;
+    _decoder_unlock(self);
+    Py_RETURN_NONE;
+#else
+    PyErr_SetString(
+        PyExc_NotImplementedError, "Scaling requires libavif 1.0.0 or later");
+    return NULL;
+#endif
+}
+
+// Must be called with the decoder lock held
+static int
+_decoder_check_frame_index(AvifDecoderObject *self, uint32_t frame_index) {
+    if (frame_index >= (uint32_t)self->decoder->imageCount) {
+        PyErr_Format(PyExc_IndexError, "frame index %u out of range", frame_index);
+        return 0;
+    }
+    return 1;
+}
+
+PyObject *
+_decoder_is_keyframe(AvifDecoderObject *self, PyObject *args) {
+    uint32_t frame_index;
+    avifBool is_keyframe;
+
+    if (!PyArg_ParseTuple(args, "I", &frame_index)) {
+        return NULL;
+    }
+
+    _decoder_lock(self);
+    if (!_decoder_check_frame_index(self, frame_index)) {
+        _decoder_unlock(self);
+        return NULL;
+    }
+    is_keyframe = avifDecoderIsKeyframe(self->decoder, frame_index);
+    _decoder_unlock(self);
+
+    return PyBool_FromLong(is_keyframe);
+}
+
+PyObject *
+_decoder_nearest_keyframe(AvifDecoderObject *self, PyObject *args) {
+    uint32_t frame_index, keyframe_index;
+
+    if (!PyArg_ParseTuple(args, "I", &frame_index)) {
+        return NULL;
+    }
+
+    _decoder_lock(self);
+    if (!_decoder_check_frame_index(self, frame_index)) {
+        _decoder_unlock(self);
+        return NULL;
+    }
+    keyframe_index = avifDecoderNearestKeyframe(self->decoder, frame_index);
+    _decoder_unlock(self);
+
+    return Py_BuildValue("I", keyframe_index);
+}
+
+PyObject *
+_decoder_get_keyframes(AvifDecoderObject *self) {
+    uint32_t i, count = 0;
+    uint32_t image_count;
+    PyObject *keyframes = NULL;
+
+    _decoder_lock(self);
+
+    if (self->keyframes == NULL) {
+        image_count = (uint32_t)self->decoder->imageCount;
+        for (i = 0; i < image_count; i++) {
+            if (avifDecoderIsKeyframe(self->decoder, i)) {
+                count++;
+            }
+        }
+        self->keyframes = PyTuple_New(count);
+        if (self->keyframes == NULL) {
+            goto end;
+        }
+        for (i = 0, count = 0; i < image_count; i++) {
+            if (avifDecoderIsKeyframe(self->decoder, i)) {
+                PyObject *index = Py_BuildValue("I", i);
+                if (index == NULL) {
+                    Py_CLEAR(self->keyframes);
+                    goto end;
+                }
+                PyTuple_SET_ITEM(self->keyframes, count++, index);
+            }
+        }
+    }
+
+    keyframes = self->keyframes;
+    Py_INCREF(keyframes);
+
+end:
+    _decoder_unlock(self);
+    return keyframes;
+}
+
+// Batch decoding
+
+// A file decoded by decode_many. The worker threads don't use any Python
+// objects, only the file's buffer and the pixel buffer, which are set up
+// beforehand while holding the GIL.
+typedef struct {
+    Py_buffer buffer;
+    avifDecoder *decoder;
+    avifResult result;
+    const char *error;
+    PyObject *pixels;
+    uint8_t *pixels_data;
+    uint32_t width;
+    uint32_t height;
+    uint32_t row_bytes;
+    int has_alpha;
+    int gray;
+} BatchDecodeJob;
+
+typedef struct {
+    BatchDecodeJob *jobs;
+    Py_ssize_t n_jobs;
+    Py_ssize_t next_job;
+    int stage;
+    int active_workers;
+    PyThread_type_lock lock;
+    PyThread_type_lock done;
+    avifCodecChoice codec;
+    avifChromaUpsampling upsampling;
+    int threads_per_image;
+    uint32_t size_limit;
+    uint32_t dimension_limit;
+    uint32_t count_limit;
+} BatchDecodePool;
+
+// The files are all parsed first, so that their pixel buffers can be created
+// before they are all decoded
+enum { BATCH_PARSE, BATCH_DECODE };
+
+static void
+_batch_parse(BatchDecodePool *pool, BatchDecodeJob *job) {
+    avifDecoder *decoder = avifDecoderCreate();
+    avifImage *image;
+
+    if (decoder == NULL) {
+        job->result = AVIF_RESULT_OUT_OF_MEMORY;
+        job->error = "Can't allocate decoder";
+        return;
+    }
+    job->decoder = decoder;
+
+#if AVIF_VERSION >= 80400
+    decoder->maxThreads = pool->threads_per_image;
+#endif
+#if AVIF_VERSION >= 90200
+    decoder->strictFlags &= ~AVIF_STRICT_CLAP_VALID;
+    decoder->strictFlags &= ~AVIF_STRICT_PIXI_REQUIRED;
+#endif
+#if AVIF_VERSION >= 90000
+    decoder->ignoreExif = AVIF_TRUE;
+    decoder->ignoreXMP = AVIF_TRUE;
+#endif
+    decoder->codecChoice = pool->codec;
+    _decoder_set_limits(
+        decoder, pool->size_limit, pool->dimension_limit, pool->count_limit);
+
+    job->result = avifDecoderSetIOMemory(
+        decoder, (const uint8_t *)job->buffer.buf, job->buffer.len);
+    if (job->result == AVIF_RESULT_OK) {
+        job->result = avifDecoderParse(decoder);
+    }
+    if (job->result != AVIF_RESULT_OK) {
+        job->error = "Failed to decode image";
+        return;
+    }
+
+    image = decoder->image;
+    job->width = image->width;
+    job->height = image->height;
+    job->has_alpha = decoder->alphaPresent ? 1 : 0;
+    job->gray = image->yuvFormat == AVIF_PIXEL_FORMAT_YUV400;
+    job->row_bytes = image->width * ((job->gray ? 1 : 3) + job->has_alpha);
+}
+
+static void
+_batch_decode(BatchDecodePool *pool, BatchDecodeJob *job) {
+    avifImage *image;
+    avifRGBImage rgb;
+
+    job->result = avifDecoderNextImage(job->decoder);
+    if (job->result != AVIF_RESULT_OK) {
+        job->error = "Failed to decode image";
+        goto end;
+    }
+
+    image = job->decoder->image;
+    if (image->width != job->width || image->height != job->height ||
+        (image->yuvFormat == AVIF_PIXEL_FORMAT_YUV400) != job->gray) {
+        job->result = AVIF_RESULT_UNKNOWN_ERROR;
+        job->error = "Decoded image doesn't match the image properties";
+        goto end;
+    }
+
+    if (job->gray) {
+        job->result = _image_to_gray(image, job->has_alpha, 8, job->pixels_data);
+    } else {
+        avifRGBImageSetDefaults(&rgb, image);
+        rgb.depth = 8;
+        rgb.format = job->has_alpha ? AVIF_RGB_FORMAT_RGBA : AVIF_RGB_FORMAT_RGB;
+        rgb.chromaUpsampling = pool->upsampling;
+        rgb.rowBytes = job->row_bytes;
+        rgb.pixels = job->pixels_data;
+        job->result = avifImageYUVToRGB(image, &rgb);
+    }
+    if (job->result != AVIF_RESULT_OK) {
+        job->error = "Conversion from YUV failed";
+    }
+
+end:
+    // Free the decoder's memory as soon as possible
+    avifDecoderDestroy(job->decoder);
+    job->decoder = NULL;
+}
+
+// Runs the current stage of the jobs that haven't failed yet, taking them in
+// order until there are none left.
+static void
+_batch_decode_worker(void *arg) {
+    BatchDecodePool *pool = (BatchDecodePool *)arg;
+    BatchDecodeJob *job;
+    Py_ssize_t i;
+    int last;
+
+    for (;;) {
+        PyThread_acquire_lock(pool->lock, WAIT_LOCK);
+        i = pool->next_job++;
+        PyThread_release_lock(pool->lock);
+        if (i >= pool->n_jobs) {
+            break;
+        }
+        job = &pool->jobs[i];
+        if (job->result != AVIF_RESULT_OK) {
+            continue;
+        }
+        if (pool->stage == BATCH_PARSE) {
+            _batch_parse(pool, job);
+        } else {
+            _batch_decode(pool, job);
+        }
+    }
+
+    PyThread_acquire_lock(pool->lock, WAIT_LOCK);
+    last = --pool->active_workers == 0;
+    PyThread_release_lock(pool->lock);
+    if (last) {
+        PyThread_release_lock(pool->done);
+    }
+}
+
+// Runs a stage of all the jobs on up to max_workers threads, including the
+// calling thread, and waits for it to finish. Must be called with the GIL.
+static void
+_batch_decode_run(BatchDecodePool *pool, int stage, int max_workers) {
+    int i, n_workers = max_workers;
+
+    if (pool->n_jobs == 0) {
+        return;
+    }
+    if (n_workers > pool->n_jobs) {
+        n_workers = (int)pool->n_jobs;
+    }
+    pool->stage = stage;
+    pool->next_job = 0;
+    pool->active_workers = n_workers;
+    PyThread_acquire_lock(pool->done, WAIT_LOCK);
+
+    for (i = 1; i < n_workers; i++) {
+        if ((long)PyThread_start_new_thread(_batch_decode_worker, pool) == -1) {
+            break;
+        }
+    }
+    if (i < n_workers) {
+        // The threads that did start share the jobs with the calling thread
+        PyThread_acquire_lock(pool->lock, WAIT_LOCK);
+        pool->active_workers -= n_workers - i;
+        PyThread_release_lock(pool->lock);
+    }
+
+    Py_BEGIN_ALLOW_THREADS;
+    _batch_decode_worker(pool);
+    PyThread_acquire_lock(pool->done, WAIT_LOCK);
+    Py_END_ALLOW_THREADS;
+    PyThread_release_lock(pool->done);
+}
+
+// Decodes the first frame of each of a sequence of bytes-like objects on a
+// pool of native threads, without holding the GIL. Returns a list with a
+// (mode, size, pixels) tuple for each file, or the exception for the files
+// that couldn't be decoded.
+PyObject *
+_decode_many(PyObject *self, PyObject *args) {
+    PyObject *sources;
+    PyObject *seq = NULL;
+    PyObject *ret = NULL;
+    char *codec_str;
+    char *upsampling_str;
+    int max_workers;
+    int threads_per_image;
+    BatchDecodePool pool;
+    BatchDecodeJob *job;
+    Py_ssize_t i;
+
+    memset(&pool, 0, sizeof(pool));
+    if (!PyArg_ParseTuple(
+            args,
+            "Ossii|III",
+            &sources,
+            &codec_str,
+            &upsampling_str,
+            &max_workers,
+            &threads_per_image,
+            &pool.size_limit,
+            &pool.dimension_limit,
+            &pool.count_limit)) {
+        return NULL;
+    }
+
+    if (!_decoder_upsampling_from_string(upsampling_str, &pool.upsampling)) {
+        return NULL;
+    }
+    if (strcmp(codec_str, "auto") == 0) {
+        pool.codec = AVIF_CODEC_CHOICE_AUTO;
+    } else {
+        pool.codec = avifCodecChoiceFromName(codec_str);
+    }
+    pool.threads_per_image = threads_per_image < 1 ? 1 : threads_per_image;
+    if (max_workers < 1) {
+        if (default_max_threads == 0) {
+            init_max_threads();
+        }
+        max_workers = default_max_threads < 1 ? 1 : default_max_threads;
+    }
+
+    seq = PySequence_Fast(sources, "expected a sequence of bytes-like objects");
+    if (seq == NULL) {
+        return NULL;
+    }
+    pool.n_jobs = PySequence_Fast_GET_SIZE(seq);
+    pool.jobs = calloc(pool.n_jobs ? pool.n_jobs : 1, sizeof(BatchDecodeJob));
+    pool.lock = PyThread_allocate_lock();
+    pool.done = PyThread_allocate_lock();
+    if (pool.jobs == NULL || pool.lock == NULL || pool.done == NULL) {
+        PyErr_NoMemory();
+        goto end;
+    }
+
+    for (i = 0; i < pool.n_jobs; i++) {
+        if (PyObject_GetBuffer(
+                PySequence_Fast_GET_ITEM(seq, i), &pool.jobs[i].buffer, PyBUF_SIMPLE) <
+            0) {
+            goto end;
+        }
+    }
+
+    _batch_decode_run(&pool, BATCH_PARSE, max_workers);
+
+    // Decode straight into the buffers that are returned
+    for (i = 0; i < pool.n_jobs; i++) {
+        job = &pool.jobs[i];
+        if (job->result != AVIF_RESULT_OK) {
+            continue;
+        }
+        if (job->height && job->row_bytes > PY_SSIZE_T_MAX / job->height) {
+            job->result = AVIF_RESULT_OUT_OF_MEMORY;
+            job->error = "Integer overflow in pixel size";
+            continue;
+        }
+        job->pixels = PyByteArray_FromStringAndSize(
+            NULL, (Py_ssize_t)job->row_bytes * job->height);
+        if (job->pixels == NULL) {
+            goto end;
+        }
+        job->pixels_data = (uint8_t *)PyByteArray_AS_STRING(job->pixels);
+    }
+
+    _batch_decode_run(&pool, BATCH_DECODE, max_workers);
+
+    ret = PyList_New(pool.n_jobs);
+    if (ret == NULL) {
+        goto end;
+    }
+    for (i = 0; i < pool.n_jobs; i++) {
+        PyObject *item;
+        job = &pool.jobs[i];
+        if (job->result == AVIF_RESULT_OK) {
+            item = Py_BuildValue(
+                "s(II)O",
+                job->gray ? (job->has_alpha ? "LA" : "L")
+                          : (job->has_alpha ? "RGBA" : "RGB"),
+                job->width,
+                job->height,
+                job->pixels);
+        } else {
+            // The same message as the decoder's exceptions
+            char message[256];
+            PyOS_snprintf(
+                message,
+                sizeof(message),
+                "%s: %s",
+                job->error,
+                avifResultToString(job->result));
+            item = PyObject_CallFunction(
+                exc_type_for_avif_result(job->result), "s", message);
+        }
+        if (item == NULL) {
+            Py_CLEAR(ret);
+            goto end;
+        }
+        PyList_SET_ITEM(ret, i, item);
+    }
+
+end:
+    if (pool.jobs) {
+        for (i = 0; i < pool.n_jobs; i++) {
+            job = &pool.jobs[i];
+            if (job->decoder) {
+                avifDecoderDestroy(job->decoder);
+            }
+            if (job->buffer.obj) {
+                PyBuffer_Release(&job->buffer);
+            }
+            Py_XDECREF(job->pixels);
+        }
+        free(pool.jobs);
+    }
+    if (pool.lock) {
+        PyThread_free_lock(pool.lock);
+    }
+    if (pool.done) {
+        PyThread_free_lock(pool.done);
+    }
+    Py_DECREF(seq);
 
     return ret;
 }
@@ -1043,10 +2505,41 @@ static PyTypeObject AvifEncoder_Type = {
     .tp_methods = _encoder_methods,
 };
 
+#if PY_VERSION_HEX >= 0x03000000
+static PyBufferProcs _data_as_buffer = {
+    .bf_getbuffer = (getbufferproc)_data_getbuffer,
+};
+
+static PySequenceMethods _data_as_sequence = {
+    .sq_length = (lenfunc)_data_length,
+};
+
+// AvifData type definition
+static PyTypeObject AvifData_Type = {
+    // clang-format off
+    PyVarObject_HEAD_INIT(NULL, 0)
+    .tp_name = "AvifData",
+    // clang-format on
+    .tp_basicsize = sizeof(AvifDataObject),
+    .tp_dealloc = (destructor)_data_dealloc,
+    .tp_as_sequence = &_data_as_sequence,
+    .tp_as_buffer = &_data_as_buffer,
+    .tp_flags = Py_TPFLAGS_DEFAULT,
+};
+#endif
+
 // AvifDecoder methods
 static struct PyMethodDef _decoder_methods[] = {
     {"get_info", (PyCFunction)_decoder_get_info, METH_NOARGS},
     {"get_frame", (PyCFunction)_decoder_get_frame, METH_VARARGS},
+    {"get_yuv_info", (PyCFunction)_decoder_get_yuv_info, METH_NOARGS},
+    {"get_yuv_frame", (PyCFunction)_decoder_get_yuv_frame, METH_VARARGS},
+    {"get_timings", (PyCFunction)_decoder_get_timings, METH_NOARGS},
+    {"set_source", (PyCFunction)_decoder_set_source, METH_VARARGS},
+    {"set_scaled_size", (PyCFunction)_decoder_set_scaled_size, METH_VARARGS},
+    {"is_keyframe", (PyCFunction)_decoder_is_keyframe, METH_VARARGS},
+    {"nearest_keyframe", (PyCFunction)_decoder_nearest_keyframe, METH_VARARGS},
+    {"get_keyframes", (PyCFunction)_decoder_get_keyframes, METH_NOARGS},
     {NULL, NULL} /* sentinel */
 };
 
@@ -1060,6 +2553,8 @@ static PyTypeObject AvifDecoder_Type = {
     .tp_itemsize = 0,
     .tp_dealloc = (destructor)_decoder_dealloc,
     .tp_flags = Py_TPFLAGS_DEFAULT,
+    .tp_iter = PyObject_SelfIter,
+    .tp_iternext = (iternextfunc)_decoder_iternext,
     .tp_methods = _decoder_methods,
 };
 
@@ -1098,6 +2593,7 @@ static PyMethodDef avifMethods[] = {
     {"AvifDecoder", AvifDecoderNew, METH_VARARGS},
     {"AvifEncoder", AvifEncoderNew, METH_VARARGS},
     {"AvifCodecVersions", AvifCodecVersions, METH_NOARGS},
+    {"decode_many", _decode_many, METH_VARARGS},
     {"decoder_codec_available", _decoder_codec_available, METH_VARARGS},
     {"encoder_codec_available", _encoder_codec_available, METH_VARARGS},
     {NULL, NULL}};
@@ -1122,9 +2618,26 @@ setup_module(PyObject *m) {
     }
     Py_DECREF(v);
 
+#if AVIF_VERSION >= 1000000
+    // Scaling is implemented with libyuv, which libavif may be built without
+    v = PyBool_FromLong(avifLibYUVVersion() != 0);
+#else
+    v = PyBool_FromLong(0);
+#endif
+    if (PyDict_SetItemString(d, "scaling_available", v) < 0) {
+        Py_DECREF(v);
+        return -1;
+    }
+    Py_DECREF(v);
+
     if (PyType_Ready(&AvifDecoder_Type) < 0 || PyType_Ready(&AvifEncoder_Type) < 0) {
         return -1;
     }
+#if PY_VERSION_HEX >= 0x03000000
+    if (PyType_Ready(&AvifData_Type) < 0) {
+        return -1;
+    }
+#endif
     return 0;
 }
 
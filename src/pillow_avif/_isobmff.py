@@ -0,0 +1,908 @@
+"""
+A minimal reader for the ISOBMFF boxes of AVIF files, to find out the basic
+properties of an image without creating an AV1 decoder.
+"""
+from collections import namedtuple
+import struct
+
+AvifProbeInfo = namedtuple(
+    "AvifProbeInfo",
+    ["width", "height", "n_frames", "has_alpha", "depth", "subsampling"],
+)
+
+_AVIF_BRANDS = (b"avif", b"avis")
+_ALPHA_URNS = (
+    b"urn:mpeg:mpegB:cicp:systems:auxiliary:alpha",
+    b"urn:mpeg:hevc:2015:auxid:1",
+)
+# Top level boxes that the properties of an image are read from
+_PROBE_BOXES = (b"ftyp", b"meta", b"moov")
+
+
+class Box(object):
+    """
+    A box in a buffer, with the offsets of its payload (after the header and,
+    for full boxes, the version and flags).
+    """
+
+    def __init__(self, data, box_type, start, payload, end):
+        self.data = data
+        self.type = box_type
+        self.start = start
+        self.payload = payload
+        self.end = end
+        self._version_flags = None
+
+    def full(self):
+        """
+        Returns the version and flags of a full box, which are then skipped
+        in the payload.
+        """
+        if self._version_flags is None:
+            (version_flags,) = struct.unpack_from(">L", self.data, self.payload)
+            self.payload += 4
+            self._version_flags = (version_flags >> 24, version_flags & 0xFFFFFF)
+        return self._version_flags
+
+    def children(self, offset=0):
+        return iter_boxes(self.data, self.payload + offset, self.end)
+
+    def find(self, *path):
+        box = self
+        for box_type in path:
+            box = next((b for b in box.children() if b.type == box_type), None)
+            if box is None:
+                return None
+        return box
+
+    def unpack(self, fmt, offset=0):
+        return struct.unpack_from(fmt, self.data, self.payload + offset)
+
+
+def _read_box_header(data, offset, end):
+    if end - offset < 8:
+        msg = "truncated box header"
+        raise SyntaxError(msg)
+    size, box_type = struct.unpack_from(">L4s", data, offset)
+    header_size = 8
+    if size == 1:
+        if end - offset < 16:
+            msg = "truncated box header"
+            raise SyntaxError(msg)
+        (size,) = struct.unpack_from(">Q", data, offset + 8)
+        header_size = 16
+    elif size == 0:
+        size = end - offset
+    if size < header_size:
+        msg = "invalid box size"
+        raise SyntaxError(msg)
+    return box_type, header_size, size
+
+
+def iter_boxes(data, offset, end):
+    while offset < end:
+        box_type, header_size, size = _read_box_header(data, offset, end)
+        if offset + size > end:
+            msg = "truncated %r box" % box_type
+            raise SyntaxError(msg)
+        yield Box(data, box_type, offset, offset + header_size, offset + size)
+        offset += size
+
+
+class Reader(object):
+    """
+    Reads byte ranges of a file object or a buffer, at offsets relative to
+    ``start``.
+    """
+
+    def __init__(self, source, start=0):
+        self.source = source
+        self.start = start
+
+    def read(self, offset, size=None):
+        """Reads ``size`` bytes at ``offset``, or the rest of the file."""
+        if hasattr(self.source, "read"):
+            self.source.seek(self.start + offset)
+            return self.source.read(-1 if size is None else size)
+        start = self.start + offset
+        data = self.source[start : None if size is None else start + size]
+        return data.tobytes() if isinstance(data, memoryview) else bytes(data)
+
+
+def read_top_level_boxes(reader, box_types):
+    """
+    Reads the top level boxes of the given types, skipping past all others.
+    Returns a dict of the boxes by type.
+    """
+    boxes = {}
+    offset = 0
+    while True:
+        header = reader.read(offset, 16)
+        if len(header) < 8:
+            break
+        box_type, header_size, size = _read_box_header(header, 0, len(header))
+        if struct.unpack_from(">L", header)[0] == 0:
+            # The box extends to the end of the file
+            size = None
+        if box_type in box_types:
+            data = reader.read(offset, size)
+            if size is not None and len(data) < size:
+                msg = "truncated %r box" % box_type
+                raise SyntaxError(msg)
+            boxes[box_type] = Box(data, box_type, 0, header_size, len(data))
+        if size is None:
+            break
+        offset += size
+    return boxes
+
+
+def _check_ftyp(ftyp):
+    if ftyp is None:
+        msg = "not an AVIF file"
+        raise SyntaxError(msg)
+    brands = [ftyp.data[i : i + 4] for i in range(ftyp.payload, ftyp.end, 4)]
+    # Skip the minor version
+    del brands[1:2]
+    if not any(brand in _AVIF_BRANDS for brand in brands):
+        msg = "not an AVIF file"
+        raise SyntaxError(msg)
+
+
+def _parse_av1c(box):
+    flags = struct.unpack_from(">B", box.data, box.payload + 2)[0]
+    high_bitdepth = flags & 0x40
+    twelve_bit = flags & 0x20
+    monochrome = flags & 0x10
+    subsampling_x = flags & 0x08
+    subsampling_y = flags & 0x04
+    if high_bitdepth:
+        depth = 12 if twelve_bit else 10
+    else:
+        depth = 8
+    if monochrome:
+        subsampling = "4:0:0"
+    elif subsampling_x and subsampling_y:
+        subsampling = "4:2:0"
+    elif subsampling_x:
+        subsampling = "4:2:2"
+    else:
+        subsampling = "4:4:4"
+    return depth, subsampling
+
+
+class ItemProperties(object):
+    """The items of a meta box, with their types, references and properties."""
+
+    def __init__(self, meta):
+        meta.full()
+        self.meta = meta
+        self.primary_id = None
+        self.types = {}
+        self.references = []
+        self.properties = []
+        self.associations = {}
+        self.locations = {}
+        self.idat = None
+
+        for box in meta.children():
+            if box.type == b"pitm":
+                version, _ = box.full()
+                (self.primary_id,) = box.unpack(">H" if version == 0 else ">L")
+            elif box.type == b"iinf":
+                self._parse_iinf(box)
+            elif box.type == b"iref":
+                self._parse_iref(box)
+            elif box.type == b"iprp":
+                self._parse_iprp(box)
+            elif box.type == b"iloc":
+                self._parse_iloc(box)
+            elif box.type == b"idat":
+                self.idat = box
+
+    def _parse_iinf(self, iinf):
+        version, _ = iinf.full()
+        for infe in iinf.children(2 if version == 0 else 4):
+            if infe.type != b"infe":
+                continue
+            version, _ = infe.full()
+            if version < 2:
+                continue
+            if version == 2:
+                item_id, _, item_type = infe.unpack(">HH4s")
+            else:
+                item_id, _, item_type = infe.unpack(">LH4s")
+            self.types[item_id] = item_type
+
+    def _parse_iref(self, iref):
+        version, _ = iref.full()
+        id_format = ">H" if version == 0 else ">L"
+        id_size = struct.calcsize(id_format)
+        for ref in iref.children():
+            offset = ref.payload
+            (from_id,) = struct.unpack_from(id_format, ref.data, offset)
+            (count,) = struct.unpack_from(">H", ref.data, offset + id_size)
+            offset += id_size + 2
+            to_ids = []
+            for _ in range(count):
+                to_ids.append(struct.unpack_from(id_format, ref.data, offset)[0])
+                offset += id_size
+            self.references.append((ref.type, from_id, to_ids))
+
+    def _parse_iprp(self, iprp):
+        ipco = iprp.find(b"ipco")
+        if ipco is not None:
+            self.properties = list(ipco.children())
+        for ipma in iprp.children():
+            if ipma.type != b"ipma":
+                continue
+            version, flags = ipma.full()
+            offset = ipma.payload
+            (count,) = struct.unpack_from(">L", ipma.data, offset)
+            offset += 4
+            for _ in range(count):
+                if version < 1:
+                    (item_id,) = struct.unpack_from(">H", ipma.data, offset)
+                    offset += 2
+                else:
+                    (item_id,) = struct.unpack_from(">L", ipma.data, offset)
+                    offset += 4
+                (n,) = struct.unpack_from(">B", ipma.data, offset)
+                offset += 1
+                indices = self.associations.setdefault(item_id, [])
+                for _ in range(n):
+                    if flags & 1:
+                        (index,) = struct.unpack_from(">H", ipma.data, offset)
+                        offset += 2
+                        indices.append((index & 0x7FFF, bool(index & 0x8000)))
+                    else:
+                        (index,) = struct.unpack_from(">B", ipma.data, offset)
+                        offset += 1
+                        indices.append((index & 0x7F, bool(index & 0x80)))
+
+    def _parse_iloc(self, iloc):
+        version, _ = iloc.full()
+        offset = iloc.payload
+        sizes, index_sizes = struct.unpack_from(">BB", iloc.data, offset)
+        offset += 2
+        offset_size, length_size = sizes >> 4, sizes & 0xF
+        base_offset_size = index_sizes >> 4
+        index_size = index_sizes & 0xF if version in (1, 2) else 0
+
+        def read_uint(size):
+            value = 0
+            for byte in bytearray(iloc.data[offset : offset + size]):
+                value = (value << 8) | byte
+            return value, offset + size
+
+        count, offset = read_uint(2 if version < 2 else 4)
+        for _ in range(count):
+            item_id, offset = read_uint(2 if version < 2 else 4)
+            construction_method = 0
+            if version in (1, 2):
+                construction_method, offset = read_uint(2)
+                construction_method &= 0xF
+            data_reference_index, offset = read_uint(2)
+            base_offset, offset = read_uint(base_offset_size)
+            extent_count, offset = read_uint(2)
+            extents = []
+            for _ in range(extent_count):
+                _, offset = read_uint(index_size)
+                extent_offset, offset = read_uint(offset_size)
+                extent_length, offset = read_uint(length_size)
+                extents.append((base_offset + extent_offset, extent_length))
+            self.locations[item_id] = (
+                construction_method,
+                data_reference_index,
+                extents,
+            )
+
+    def get_property(self, item_id, box_type):
+        for index, _ in self.associations.get(item_id, []):
+            # Property indices start from 1, with 0 meaning no property
+            if 0 < index <= len(self.properties):
+                box = self.properties[index - 1]
+                if box.type == box_type:
+                    return box
+        return None
+
+    def referencing(self, ref_type, to_id):
+        """Returns the ids of the items with a reference to ``to_id``."""
+        return [
+            from_id
+            for box_type, from_id, to_ids in self.references
+            if box_type == ref_type and to_id in to_ids
+        ]
+
+    def referenced(self, ref_type, from_id):
+        """Returns the ids of the items that ``from_id`` refers to."""
+        for box_type, ref_from_id, to_ids in self.references:
+            if box_type == ref_type and ref_from_id == from_id:
+                return to_ids
+        return []
+
+    def is_alpha(self, item_id):
+        auxc = self.get_property(item_id, b"auxC")
+        if auxc is None:
+            return False
+        auxc.full()
+        urn = auxc.data[auxc.payload : auxc.end].split(b"\0", 1)[0]
+        return urn in _ALPHA_URNS
+
+    def alpha_item(self, item_id):
+        """Returns the id of the alpha item of ``item_id``, if it has one."""
+        for alpha_id in self.referencing(b"auxl", item_id):
+            if self.is_alpha(alpha_id):
+                return alpha_id
+        return None
+
+    def read_item(self, reader, item_id):
+        """Reads the data of an item, from the file or the idat box."""
+        construction_method, data_reference_index, extents = self.locations[item_id]
+        if data_reference_index != 0 or construction_method not in (0, 1):
+            msg = "unsupported item location"
+            raise SyntaxError(msg)
+        chunks = []
+        for offset, length in extents:
+            if construction_method == 0:
+                chunk = reader.read(offset, length or None)
+            else:
+                start = self.idat.payload + offset
+                end = self.idat.end if length == 0 else start + length
+                chunk = self.idat.data[start:end]
+            if length and len(chunk) < length:
+                msg = "truncated item data"
+                raise SyntaxError(msg)
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    def coded_item(self, item_id):
+        """Returns the id of an item with an av1C property, following grids."""
+        if self.types.get(item_id) == b"grid":
+            tiles = self.referenced(b"dimg", item_id)
+            if tiles:
+                return tiles[0]
+        return item_id
+
+
+def _probe_items(meta):
+    items = ItemProperties(meta)
+    if items.primary_id is None:
+        msg = "missing primary item"
+        raise SyntaxError(msg)
+    ispe = items.get_property(items.primary_id, b"ispe")
+    av1c = items.get_property(items.coded_item(items.primary_id), b"av1C")
+    if ispe is None or av1c is None:
+        msg = "missing image properties"
+        raise SyntaxError(msg)
+    ispe.full()
+    width, height = ispe.unpack(">LL")
+    depth, subsampling = _parse_av1c(av1c)
+    has_alpha = items.alpha_item(items.primary_id) is not None
+    return AvifProbeInfo(width, height, 1, has_alpha, depth, subsampling)
+
+
+def _probe_tracks(moov):
+    tracks = []
+    alpha_refs = set()
+    for trak in moov.children():
+        if trak.type != b"trak":
+            continue
+        tkhd = trak.find(b"tkhd")
+        hdlr = trak.find(b"mdia", b"hdlr")
+        stbl = trak.find(b"mdia", b"minf", b"stbl")
+        if tkhd is None or hdlr is None or stbl is None:
+            continue
+        version, _ = tkhd.full()
+        (track_id,) = tkhd.unpack(">L", 16 if version == 1 else 8)
+        width, height = tkhd.unpack(">LL", 84 if version == 1 else 72)
+        hdlr.full()
+        (handler,) = hdlr.unpack(">4s", 4)
+
+        auxl = trak.find(b"tref", b"auxl")
+        if auxl is not None:
+            for offset in range(auxl.payload, auxl.end - 3, 4):
+                alpha_refs.add(struct.unpack_from(">L", auxl.data, offset)[0])
+
+        n_frames = 0
+        stsz = stbl.find(b"stsz") or stbl.find(b"stz2")
+        if stsz is not None:
+            stsz.full()
+            (n_frames,) = stsz.unpack(">L", 4)
+
+        av1c = None
+        stsd = stbl.find(b"stsd")
+        if stsd is not None:
+            stsd.full()
+            for entry in stsd.children(4):
+                if entry.type == b"av01":
+                    # Skip the fields of the VisualSampleEntry
+                    av1c = next(
+                        (b for b in entry.children(78) if b.type == b"av1C"), None
+                    )
+                    break
+        tracks.append(
+            (
+                track_id,
+                handler,
+                auxl is not None,
+                width >> 16,
+                height >> 16,
+                n_frames,
+                av1c,
+            )
+        )
+
+    for track_id, handler, is_aux, width, height, n_frames, av1c in tracks:
+        if handler == b"pict" and not is_aux and av1c is not None:
+            depth, subsampling = _parse_av1c(av1c)
+            return AvifProbeInfo(
+                width, height, n_frames, track_id in alpha_refs, depth, subsampling
+            )
+    return None
+
+
+def thumbnail_items(items):
+    """
+    Returns the id of the color item, the id of the alpha item (or None) and
+    the size of each AV1 coded thumbnail of the primary item.
+    """
+    thumbnails = []
+    for item_id in items.referencing(b"thmb", items.primary_id):
+        ispe = items.get_property(item_id, b"ispe")
+        if items.types.get(item_id) != b"av01" or ispe is None:
+            continue
+        ispe.full()
+        width, height = ispe.unpack(">LL")
+        thumbnails.append((item_id, items.alpha_item(item_id), width, height))
+    return thumbnails
+
+
+def _box(box_type, payload):
+    return struct.pack(">L4s", 8 + len(payload), box_type) + payload
+
+
+def _full_box(box_type, version, flags, payload):
+    return _box(box_type, struct.pack(">L", (version << 24) | flags) + payload)
+
+
+def _pack_uint(value, size):
+    if size == 0:
+        return b""
+    return struct.pack({2: ">H", 4: ">L", 8: ">Q"}[size], value)
+
+
+def _encode_infe(item_id, item_type):
+    if item_id > 0xFFFF:
+        payload = struct.pack(">LH4s", item_id, 0, item_type)
+        return _full_box(b"infe", 3, 0, payload + b"\0")
+    payload = struct.pack(">HH4s", item_id, 0, item_type)
+    return _full_box(b"infe", 2, 0, payload + b"\0")
+
+
+def _encode_iinf(infes):
+    if len(infes) > 0xFFFF:
+        return _full_box(b"iinf", 1, 0, struct.pack(">L", len(infes)) + b"".join(infes))
+    return _full_box(b"iinf", 0, 0, struct.pack(">H", len(infes)) + b"".join(infes))
+
+
+def _encode_iref(references):
+    large = any(
+        max([from_id] + list(to_ids)) > 0xFFFF for _, from_id, to_ids in references
+    )
+    id_size = 4 if large else 2
+    payload = b""
+    for ref_type, from_id, to_ids in references:
+        ref = _pack_uint(from_id, id_size) + struct.pack(">H", len(to_ids))
+        ref += b"".join(_pack_uint(to_id, id_size) for to_id in to_ids)
+        payload += _box(ref_type, ref)
+    return _full_box(b"iref", 1 if large else 0, 0, payload)
+
+
+def _encode_ipma(associations):
+    large_ids = any(item_id > 0xFFFF for item_id in associations)
+    large_indices = any(
+        index > 0x7F for indices in associations.values() for index, _ in indices
+    )
+    payload = struct.pack(">L", len(associations))
+    for item_id in sorted(associations):
+        indices = associations[item_id]
+        payload += _pack_uint(item_id, 4 if large_ids else 2)
+        payload += struct.pack(">B", len(indices))
+        for index, essential in indices:
+            if large_indices:
+                payload += struct.pack(">H", index | (0x8000 if essential else 0))
+            else:
+                payload += struct.pack(">B", index | (0x80 if essential else 0))
+    return _full_box(b"ipma", 1 if large_ids else 0, int(large_indices), payload)
+
+
+def _encode_iloc(locations):
+    values = [
+        value
+        for _, _, extents in locations.values()
+        for extent in extents
+        for value in extent
+    ]
+    offset_size = length_size = 8 if any(v > 0xFFFFFFFF for v in values) else 4
+    if any(item_id > 0xFFFF for item_id in locations):
+        version = 2
+    elif any(method != 0 for method, _, _ in locations.values()):
+        version = 1
+    else:
+        version = 0
+    id_size = 4 if version == 2 else 2
+    payload = struct.pack(">BB", (offset_size << 4) | length_size, 0)
+    payload += _pack_uint(len(locations), id_size)
+    for item_id in sorted(locations):
+        construction_method, data_reference_index, extents = locations[item_id]
+        payload += _pack_uint(item_id, id_size)
+        if version != 0:
+            payload += struct.pack(">H", construction_method)
+        # No base offset, the extents have absolute offsets
+        payload += struct.pack(">HH", data_reference_index, len(extents))
+        for offset, length in extents:
+            payload += _pack_uint(offset, offset_size)
+            payload += _pack_uint(length, length_size)
+    return _full_box(b"iloc", version, 0, payload)
+
+
+def _encode_meta(boxes, get_locations):
+    """
+    Encodes a meta box with the given child boxes and an iloc box with the
+    item locations returned by ``get_locations(meta_size)``, which can depend
+    on the size of the meta box itself.
+    """
+    children = b"".join(boxes)
+    size = 12 + len(children)
+    while True:
+        meta = _full_box(b"meta", 0, 0, children + _encode_iloc(get_locations(size)))
+        if len(meta) == size:
+            return meta
+        size = len(meta)
+
+
+def _copy_properties(items, item_ids, properties, exclude=()):
+    """
+    Adds the properties of the given items to the list of encoded property
+    boxes ``properties``, reusing identical ones, and skipping the types in
+    ``exclude``. Returns the associations of each of the items with the new
+    property indices.
+    """
+    associations = []
+    for item_id in item_ids:
+        indices = []
+        for index, essential in items.associations.get(item_id, []):
+            if not 0 < index <= len(items.properties):
+                continue
+            box = items.properties[index - 1]
+            if box.type in exclude:
+                continue
+            data = box.data[box.start : box.end]
+            if data not in properties:
+                properties.append(data)
+            indices.append((properties.index(data) + 1, essential))
+        associations.append(indices)
+    return associations
+
+
+def _build_file(item_types, payloads, properties, associations, references):
+    """
+    Builds an AVIF file with the given items, numbered from 1, the first of
+    which is the primary item.
+    """
+    ftyp = _box(b"ftyp", b"avif" + struct.pack(">L", 0) + b"avifmif1miaf")
+    boxes = [
+        _full_box(b"hdlr", 0, 0, struct.pack(">L4s12x", 0, b"pict") + b"\0"),
+        _full_box(b"pitm", 0, 0, struct.pack(">H", 1)),
+        _encode_iinf(
+            [_encode_infe(i + 1, item_type) for i, item_type in enumerate(item_types)]
+        ),
+    ]
+    if references:
+        boxes.append(_encode_iref(references))
+    boxes.append(
+        _box(
+            b"iprp",
+            _box(b"ipco", b"".join(properties))
+            + _encode_ipma(dict((i + 1, a) for i, a in enumerate(associations))),
+        )
+    )
+
+    def get_locations(meta_size):
+        locations = {}
+        offset = len(ftyp) + meta_size + 8
+        for i, payload in enumerate(payloads):
+            locations[i + 1] = (0, 0, [(offset, len(payload))])
+            offset += len(payload)
+        return locations
+
+    meta = _encode_meta(boxes, get_locations)
+    return ftyp + meta + _box(b"mdat", b"".join(payloads))
+
+
+def build_item_file(reader, items, color_id, alpha_id=None):
+    """
+    Builds an AVIF file with the image made of the color item ``color_id`` and
+    the optional alpha item ``alpha_id`` of ``items`` as its primary item, so
+    that a non-primary image such as a thumbnail can be decoded.
+    """
+    item_ids = [color_id] if alpha_id is None else [color_id, alpha_id]
+    payloads = [items.read_item(reader, item_id) for item_id in item_ids]
+    properties = []
+    associations = _copy_properties(items, item_ids, properties)
+    references = [(b"auxl", 2, [1])] if alpha_id is not None else []
+    return _build_file(
+        [b"av01"] * len(item_ids), payloads, properties, associations, references
+    )
+
+
+GridLayout = namedtuple(
+    "GridLayout", ["rows", "columns", "size", "tile_size", "tile_ids"]
+)
+
+
+def _encode_grid(rows, columns, size):
+    large = max(size) > 0xFFFF
+    header = struct.pack(">BBBB", 0, int(large), rows - 1, columns - 1)
+    return header + struct.pack(">LL" if large else ">HH", *size)
+
+
+def grid_layout(reader, items, item_id):
+    """
+    Returns the :py:class:`GridLayout` of a grid item, with the ids of its
+    tiles in row-major order, or None if the item is not a grid.
+    """
+    if items.types.get(item_id) != b"grid":
+        return None
+    data = items.read_item(reader, item_id)
+    _, flags, rows_minus_one, columns_minus_one = struct.unpack_from(">BBBB", data)
+    size = struct.unpack_from(">LL" if flags & 1 else ">HH", data, 4)
+    rows, columns = rows_minus_one + 1, columns_minus_one + 1
+    tile_ids = items.referenced(b"dimg", item_id)
+    ispe = items.get_property(tile_ids[0], b"ispe") if tile_ids else None
+    if len(tile_ids) != rows * columns or ispe is None:
+        msg = "invalid grid item"
+        raise SyntaxError(msg)
+    ispe.full()
+    return GridLayout(rows, columns, size, ispe.unpack(">LL"), tile_ids)
+
+
+def build_grid_file(reader, items, grids, columns, size):
+    """
+    Builds an AVIF file with a grid of ``columns`` columns of tiles of
+    ``items`` as its primary item, cropped to ``size``. ``grids`` has the id
+    of an item to copy the properties of the grid from, and the tile ids in
+    row-major order, for the color grid and optionally for an alpha grid.
+    """
+    grid = _encode_grid(len(grids[0][1]) // columns, columns, size)
+    ispe = _full_box(b"ispe", 0, 0, struct.pack(">LL", *size))
+    item_types, payloads, properties, associations, references = [], [], [], [], []
+    for grid_template_id, tile_ids in grids:
+        grid_id = len(item_types) + 1
+        (grid_associations,) = _copy_properties(
+            items, [grid_template_id], properties, exclude=(b"ispe", b"av1C")
+        )
+        properties.append(ispe)
+        grid_associations.append((len(properties), False))
+        item_types.append(b"grid")
+        payloads.append(grid)
+        associations.append(grid_associations)
+
+        associations += _copy_properties(items, tile_ids, properties)
+        for tile_id in tile_ids:
+            item_types.append(b"av01")
+            payloads.append(items.read_item(reader, tile_id))
+        references.append(
+            (b"dimg", grid_id, list(range(grid_id + 1, grid_id + 1 + len(tile_ids))))
+        )
+        if grid_id != 1:
+            references.append((b"auxl", grid_id, [1]))
+    return _build_file(item_types, payloads, properties, associations, references)
+
+
+def grid_region_file(reader, items, box):
+    """
+    Builds an AVIF file with only the cells of the primary grid item of
+    ``items`` that intersect ``box``. Returns the file and the position of its
+    top left corner in the full image, or None if the primary item isn't a
+    grid, or is transformed.
+    """
+    primary_id = items.primary_id
+    layout = grid_layout(reader, items, primary_id)
+    if layout is None or any(
+        items.get_property(primary_id, box_type) is not None
+        for box_type in (b"clap", b"irot", b"imir")
+    ):
+        return None
+    layouts = [(primary_id, layout)]
+    alpha_id = items.alpha_item(primary_id)
+    if alpha_id is not None:
+        alpha_layout = grid_layout(reader, items, alpha_id)
+        if alpha_layout is None or alpha_layout[:4] != layout[:4]:
+            return None
+        layouts.append((alpha_id, alpha_layout))
+
+    width, height = layout.size
+    tile_width, tile_height = layout.tile_size
+    left, top, right, bottom = box
+    columns = range(left // tile_width, (right - 1) // tile_width + 1)
+    rows = range(top // tile_height, (bottom - 1) // tile_height + 1)
+    grids = [
+        (
+            item_id,
+            [
+                item_layout.tile_ids[row * layout.columns + column]
+                for row in rows
+                for column in columns
+            ],
+        )
+        for item_id, item_layout in layouts
+    ]
+    x, y = columns[0] * tile_width, rows[0] * tile_height
+    size = (
+        min((columns[-1] + 1) * tile_width, width) - x,
+        min((rows[-1] + 1) * tile_height, height) - y,
+    )
+    return build_grid_file(reader, items, grids, len(columns), size), (x, y)
+
+
+def _shift_chunk_offsets(moov, start, delta):
+    """Shifts the sample chunk offsets of the tracks of ``moov`` past ``start``."""
+    data = bytearray(moov.data[moov.start : moov.end])
+    moov = Box(data, moov.type, 0, moov.payload - moov.start, len(data))
+    for trak in moov.children():
+        stbl = trak.find(b"mdia", b"minf", b"stbl") if trak.type == b"trak" else None
+        if stbl is None:
+            continue
+        for box in stbl.children():
+            if box.type not in (b"stco", b"co64"):
+                continue
+            box.full()
+            fmt = ">L" if box.type == b"stco" else ">Q"
+            (count,) = box.unpack(">L")
+            for i in range(count):
+                offset = box.payload + 4 + i * struct.calcsize(fmt)
+                (value,) = struct.unpack_from(fmt, data, offset)
+                if value >= start:
+                    struct.pack_into(fmt, data, offset, value + delta)
+    return bytes(data)
+
+
+def add_thumbnail(data, thumbnail_data):
+    """
+    Adds the primary image of the AVIF file ``thumbnail_data`` to the AVIF
+    file ``data`` as a thumbnail of its primary item, returning the new file.
+    """
+    top_level_boxes = list(iter_boxes(data, 0, len(data)))
+    meta = next((box for box in top_level_boxes if box.type == b"meta"), None)
+    if meta is None:
+        msg = "cannot add a thumbnail to an image without items"
+        raise ValueError(msg)
+    items = ItemProperties(meta)
+    if items.primary_id is None:
+        msg = "cannot add a thumbnail to an image without a primary item"
+        raise ValueError(msg)
+
+    thumbnail_meta = next(
+        box
+        for box in iter_boxes(thumbnail_data, 0, len(thumbnail_data))
+        if box.type == b"meta"
+    )
+    thumbnail_items = ItemProperties(thumbnail_meta)
+    thumbnail_ids = [thumbnail_items.primary_id]
+    if thumbnail_items.types.get(thumbnail_ids[0]) != b"av01":
+        msg = "the thumbnail must be a single AV1 coded image"
+        raise ValueError(msg)
+    alpha_id = thumbnail_items.alpha_item(thumbnail_ids[0])
+    if alpha_id is not None:
+        thumbnail_ids.append(alpha_id)
+    reader = Reader(thumbnail_data)
+    payloads = [thumbnail_items.read_item(reader, i) for i in thumbnail_ids]
+
+    # The new items are numbered after the existing ones
+    first_id = max([items.primary_id] + list(items.types) + list(items.locations)) + 1
+    new_ids = list(range(first_id, first_id + len(thumbnail_ids)))
+    references = items.references + [(b"thmb", new_ids[0], [items.primary_id])]
+    if alpha_id is not None:
+        references.append((b"auxl", new_ids[1], [new_ids[0]]))
+
+    properties = [box.data[box.start : box.end] for box in items.properties]
+    associations = dict(items.associations)
+    new_associations = _copy_properties(thumbnail_items, thumbnail_ids, properties)
+    associations.update(zip(new_ids, new_associations))
+
+    boxes = []
+    for box in meta.children():
+        if box.type == b"iinf":
+            version, _ = box.full()
+            infes = [
+                infe.data[infe.start : infe.end]
+                for infe in box.children(2 if version == 0 else 4)
+            ]
+            infes += [_encode_infe(item_id, b"av01") for item_id in new_ids]
+            boxes.append(_encode_iinf(infes))
+            boxes.append(_encode_iref(references))
+        elif box.type == b"iprp":
+            ipco = _box(b"ipco", b"".join(properties))
+            boxes.append(_box(b"iprp", ipco + _encode_ipma(associations)))
+        elif box.type not in (b"iref", b"iloc"):
+            boxes.append(box.data[box.start : box.end])
+
+    def get_locations(meta_size):
+        delta = meta_size - (meta.end - meta.start)
+        locations = {}
+        for item_id, location in items.locations.items():
+            construction_method, data_reference_index, extents = location
+            if construction_method == 0:
+                extents = [
+                    (offset + delta if offset >= meta.end else offset, length)
+                    for offset, length in extents
+                ]
+            locations[item_id] = (construction_method, data_reference_index, extents)
+        offset = len(data) + delta + 8
+        for item_id, payload in zip(new_ids, payloads):
+            locations[item_id] = (0, 0, [(offset, len(payload))])
+            offset += len(payload)
+        return locations
+
+    new_meta = _encode_meta(boxes, get_locations)
+    delta = len(new_meta) - (meta.end - meta.start)
+    chunks = []
+    for box in top_level_boxes:
+        if box is meta:
+            chunks.append(new_meta)
+        elif box.type == b"moov":
+            chunks.append(_shift_chunk_offsets(box, meta.end, delta))
+        else:
+            chunks.append(box.data[box.start : box.end])
+    chunks.append(_box(b"mdat", b"".join(payloads)))
+    return b"".join(chunks)
+
+
+def probe(fp):
+    """
+    Reads the size, number of frames, alpha presence, bit depth and chroma
+    subsampling of an AVIF image from its container boxes, without decoding
+    any of it. ``fp`` can be a filename, a file object or a bytes-like object.
+    Raises a SyntaxError if the file is not a valid AVIF file.
+    """
+    if isinstance(fp, (bytes, bytearray, memoryview)):
+        data = fp.tobytes() if isinstance(fp, memoryview) else bytes(fp)
+        boxes = {}
+        for box in iter_boxes(data, 0, len(data)):
+            if box.type in _PROBE_BOXES and box.type not in boxes:
+                boxes[box.type] = box
+    elif hasattr(fp, "read"):
+        boxes = read_top_level_boxes(Reader(fp, fp.tell()), _PROBE_BOXES)
+    else:
+        with open(fp, "rb") as f:
+            boxes = read_top_level_boxes(Reader(f), _PROBE_BOXES)
+
+    _check_ftyp(boxes.get(b"ftyp"))
+    try:
+        if b"moov" in boxes:
+            info = _probe_tracks(boxes[b"moov"])
+            if info is not None:
+                return info
+        if b"meta" not in boxes:
+            msg = "missing meta box"
+            raise SyntaxError(msg)
+        return _probe_items(boxes[b"meta"])
+    except struct.error:
+        msg = "truncated box"
+        raise SyntaxError(msg)
+
+
+def probe_many(paths):
+    """
+    Probes each of the given files, returning a list with an
+    :py:class:`AvifProbeInfo` for each file, or the exception raised while
+    reading it.
+    """
+    results = []
+    for path in paths:
+        try:
+            results.append(probe(path))
+        except (OSError, IOError, SyntaxError) as e:
+            results.append(e)
+    return results
@@ -0,0 +1,166 @@
+"""
+Coroutines to decode and encode AVIF images from asyncio code, without
+blocking the event loop. This module requires Python 3.7 or greater, and
+isn't imported by ``pillow_avif``.
+"""
+import asyncio
+import concurrent.futures
+import os
+import threading
+import weakref
+
+from PIL import Image
+
+from pillow_avif import AvifImagePlugin, _avif
+
+__all__ = ["AvifExecutor", "configure", "decode", "encode"]
+
+
+def _cpu_count():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _decode(cancelled, fp, all_frames, max_threads):
+    data, mapped = AvifImagePlugin._read_source(fp)
+    try:
+        return _decode_frames(cancelled, data, all_frames, max_threads)
+    finally:
+        # The frames are copies of the decoded pixels, and the decoder is gone
+        AvifImagePlugin._close_mmap(mapped)
+
+
+def _decode_frames(cancelled, source, all_frames, max_threads):
+    decoder = _avif.AvifDecoder(
+        source,
+        AvifImagePlugin.DECODE_CODEC_CHOICE,
+        AvifImagePlugin.CHROMA_UPSAMPLING,
+        max_threads,
+        AvifImagePlugin.IGNORE_EXIF,
+        AvifImagePlugin.IGNORE_XMP,
+        AvifImagePlugin.IGNORE_ICC,
+        AvifImagePlugin.IGNORE_ALPHA,
+        AvifImagePlugin.DECODE_SOURCE,
+        *AvifImagePlugin._decoder_limits()
+    )
+    width, height, n_frames, mode, icc, exif, exif_orientation, xmp = (
+        decoder.get_info()
+    )
+    # As Image.open() does, before any pixels are decoded
+    Image._decompression_bomb_check((width, height))
+    info = AvifImagePlugin._decoded_info(icc, exif, exif_orientation, xmp)
+
+    frames = []
+    for _ in range(n_frames if all_frames else 1):
+        if cancelled.is_set():
+            return None
+        data, timescale, pts_in_timescales, duration_in_timescales = next(decoder)
+        frame = Image.frombuffer(mode, (width, height), data, "raw", mode, 0, 1)
+        # The pixels are a private, writable buffer
+        frame.readonly = 0
+        frame.info.update(info)
+        frame.info["timestamp"] = round(1000 * (pts_in_timescales / timescale))
+        frame.info["duration"] = round(1000 * (duration_in_timescales / timescale))
+        frames.append(frame)
+    return frames if all_frames else frames[0]
+
+
+def _encode(cancelled, im, options):
+    data = AvifImagePlugin._encode(
+        im, options, options.get("save_all", False), cancelled.is_set
+    )
+    return None if data is None else memoryview(data)
+
+
+class AvifExecutor(object):
+    """
+    Decodes and encodes AVIF images on its own thread pool, for up to
+    ``max_concurrency`` images at once, which share a budget of
+    ``max_threads`` codec threads equally. Both default to the number of
+    CPUs.
+    """
+
+    def __init__(self, max_concurrency=None, max_threads=None):
+        self.max_threads = max_threads or _cpu_count()
+        self.max_concurrency = max_concurrency or self.max_threads
+        self.threads_per_image = max(1, self.max_threads // self.max_concurrency)
+        self._executor = concurrent.futures.ThreadPoolExecutor(self.max_concurrency)
+        # Before Python 3.10, a semaphore can only be used in one event loop
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(
+                self.max_concurrency
+            )
+        cancelled = threading.Event()
+        async with semaphore:
+            future = loop.run_in_executor(self._executor, func, cancelled, *args)
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # The work stops before the next frame. Keep its place until
+                # then, so that the concurrency limit holds.
+                cancelled.set()
+                await asyncio.wait([future])
+                raise
+
+    async def decode(self, fp, all_frames=False):
+        """
+        Decodes the first frame of an AVIF image, or a list of all of its
+        frames if ``all_frames`` is True. ``fp`` can be a filename, a file
+        object or a bytes-like object. The decoder options are the globals of
+        :py:mod:`~pillow_avif.AvifImagePlugin`.
+
+        If the task is cancelled, decoding stops before the next frame.
+        """
+        return await self._run(_decode, fp, all_frames, self.threads_per_image)
+
+    async def encode(self, im, **options):
+        """
+        Encodes an image, or all of its frames with ``save_all=True``, and
+        returns the AVIF file as a read-only memoryview. The options are the same as for
+        ``im.save(fp, "AVIF", **options)``. ``im`` must not be used until
+        this returns.
+
+        If the task is cancelled, encoding stops before the next frame.
+        """
+        options.setdefault("max_threads", self.threads_per_image)
+        return await self._run(_encode, im, options)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = AvifExecutor()
+    return _executor
+
+
+def configure(max_concurrency=None, max_threads=None):
+    """
+    Replaces the :py:class:`AvifExecutor` used by :py:func:`decode` and
+    :py:func:`encode`. Work already started on the previous one carries on.
+    """
+    global _executor
+    previous, _executor = _executor, AvifExecutor(max_concurrency, max_threads)
+    if previous is not None:
+        previous.shutdown(wait=False)
+
+
+async def decode(fp, all_frames=False):
+    """Decodes an AVIF image with the default :py:class:`AvifExecutor`."""
+    return await _get_executor().decode(fp, all_frames)
+
+
+async def encode(im, **options):
+    """Encodes an AVIF image with the default :py:class:`AvifExecutor`."""
+    return await _get_executor().encode(im, **options)
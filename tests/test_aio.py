@@ -0,0 +1,76 @@
+import asyncio
+from io import BytesIO
+import os
+
+import pytest
+
+from PIL import Image
+from pillow_avif import aio
+
+from .helper import assert_image, assert_image_similar, hopper
+
+CURR_DIR = os.path.dirname(os.path.dirname(__file__))
+TEST_AVIF_FILE = "%s/tests/images/hopper.avif" % CURR_DIR
+
+
+class TestAvifAio:
+    def test_decode(self):
+        im = asyncio.run(aio.decode(TEST_AVIF_FILE))
+        with Image.open(TEST_AVIF_FILE) as expected:
+            assert_image(im, expected.mode, expected.size)
+            assert im.tobytes() == expected.tobytes()
+
+    def test_decode_all_frames(self):
+        with open("tests/images/star.avifs", "rb") as f:
+            frames = asyncio.run(aio.decode(f, all_frames=True))
+        assert len(frames) == 5
+        with Image.open("tests/images/star.avifs") as im:
+            for i, frame in enumerate(frames):
+                im.seek(i)
+                assert frame.tobytes() == im.tobytes()
+                assert frame.info["duration"] == im.info["duration"]
+
+    def test_decode_decompression_bomb(self, monkeypatch):
+        monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 128 * 64 - 1)
+        with pytest.raises(Image.DecompressionBombError):
+            asyncio.run(aio.decode(TEST_AVIF_FILE))
+
+    def test_encode(self):
+        data = asyncio.run(aio.encode(hopper(), quality=90))
+        with Image.open(BytesIO(data)) as im:
+            assert_image_similar(im, hopper(), 12.0)
+
+    def test_concurrency_limit(self):
+        executor = aio.AvifExecutor(max_concurrency=2, max_threads=4)
+        assert executor.threads_per_image == 2
+
+        async def decode_all():
+            return await asyncio.gather(
+                *[executor.decode(TEST_AVIF_FILE) for _ in range(6)]
+            )
+
+        try:
+            images = asyncio.run(decode_all())
+        finally:
+            executor.shutdown()
+        assert [im.size for im in images] == [(128, 128)] * 6
+
+    def test_cancel(self):
+        executor = aio.AvifExecutor(max_concurrency=1)
+        frames = [hopper().rotate(angle) for angle in range(0, 360, 10)]
+
+        async def encode_and_cancel():
+            task = asyncio.ensure_future(
+                executor.encode(frames[0], save_all=True, append_images=frames[1:])
+            )
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            # The slot is free again once the encoding has stopped
+            return await executor.decode(TEST_AVIF_FILE)
+
+        try:
+            assert asyncio.run(encode_and_cancel()).size == (128, 128)
+        finally:
+            executor.shutdown()
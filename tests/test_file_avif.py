@@ -1,7 +1,10 @@
+import array
 import os
+import sys
 import xml.etree.ElementTree
 from contextlib import contextmanager
 from io import BytesIO
+import threading
 import warnings
 
 try:
@@ -12,7 +15,9 @@ except ImportError:
 import pytest
 
 from PIL import Image, ImageDraw
+import pillow_avif
 from pillow_avif import AvifImagePlugin
+from pillow_avif import _isobmff
 
 from .helper import (
     PillowLeakTestCase,
@@ -178,6 +183,22 @@ class TestFileAvif:
 
         self._roundtrip(tmp_path, "RGB", 12.5)
 
+    def test_save_writes_bytes_like_data(self):
+        written = []
+
+        class File(BytesIO):
+            def write(self, data):
+                written.append(type(data))
+                return BytesIO.write(self, data)
+
+        out = File()
+        hopper().save(out, "AVIF")
+        assert written
+        assert all(data_type in (bytes, memoryview) for data_type in written)
+        out.seek(0)
+        with Image.open(out) as im:
+            assert im.size == (128, 128)
+
     def test_AvifEncoder_with_invalid_args(self):
         """
         Calling encoder functions with no arguments should result in an error.
@@ -204,11 +225,284 @@ class TestFileAvif:
                 warnings.simplefilter("error")
                 image.save(temp_file)
 
+    def test_AvifDecoder_with_invalid_data(self):
+        with pytest.raises(TypeError):
+            _avif.AvifDecoder(1234, "auto", "auto", 0)
+
+    @pytest.mark.parametrize("buffer_type", [bytearray, memoryview])
+    def test_AvifDecoder_with_buffer(self, buffer_type):
+        with open(TEST_AVIF_FILE, "rb") as f:
+            data = buffer_type(f.read())
+        decoder = _avif.AvifDecoder(data, "auto", "auto", 0)
+        assert decoder.get_info()[:3] == (128, 128, 1)
+
+    def test_read_mmap_at_offset(self, tmp_path):
+        with open(TEST_AVIF_FILE, "rb") as f:
+            data = f.read()
+        temp_file = str(tmp_path / "temp.bin")
+        with open(temp_file, "wb") as f:
+            f.write(b"\0" * 100 + data)
+
+        with open(temp_file, "rb") as fp:
+            fp.seek(100)
+            assert len(AvifImagePlugin._mmap_file(fp)) == len(data)
+            im = AvifImagePlugin.AvifImageFile(fp)
+            im.load()
+        assert_image_similar_tofile(
+            im, "%s/tests/images/hopper_avif_write.png" % CURR_DIR, 12.0
+        )
+
+    @pytest.mark.parametrize("close", (True, False))
+    def test_file_released_after_close(self, tmp_path, close):
+        temp_file = str(tmp_path / "temp.avif")
+        with open("tests/images/star.avifs", "rb") as f:
+            data = f.read()
+        with open(temp_file, "wb") as f:
+            f.write(b"\0" * 16 + data)
+
+        with open(temp_file, "rb") as f:
+            # A memory map at an offset
+            f.seek(16)
+            im = AvifImagePlugin.AvifImageFile(f)
+            im.load()
+            if close:
+                im.close()
+            else:
+                with im:
+                    pass
+            assert im._decoder is None
+        with open(temp_file, "wb") as f:
+            f.write(data)
+        os.remove(temp_file)
+
+        with Image.open(TEST_AVIF_FILE) as im:
+            im.load()
+        assert im._decoder is None
+
+    def test_close_while_decoder_in_use(self):
+        with Image.open("tests/images/star.avifs") as im:
+            im.load()
+            # Another reference to the decoder keeps the memory map exported
+            decoder = im._decoder
+        assert im._decoder is None
+        decoder.get_frame(1)
+
+    def test_mmap_file_not_on_disk(self):
+        with open(TEST_AVIF_FILE, "rb") as f:
+            assert AvifImagePlugin._mmap_file(BytesIO(f.read())) is None
+
+    def test_read_from_file_object_on_demand(self):
+        with open("%s/tests/images/star.avifs" % CURR_DIR, "rb") as f:
+            data = f.read()
+
+        class CountingBytesIO(BytesIO):
+            bytes_read = 0
+
+            def read(self, *args):
+                ret = BytesIO.read(self, *args)
+                self.bytes_read += len(ret)
+                return ret
+
+        fp = CountingBytesIO(data)
+        with Image.open(fp) as im:
+            # Opening only needs the ftyp, meta and moov boxes
+            assert fp.bytes_read < len(data) // 2
+            for frame in range(im.n_frames):
+                im.seek(frame)
+                im.load()
+        assert fp.bytes_read >= len(data) // 2
+
     def test_file_pointer_could_be_reused(self):
         with open(TEST_AVIF_FILE, "rb") as blob:
             Image.open(blob).load()
             Image.open(blob).load()
 
+    @pytest.mark.skipif(
+        not _avif or not _avif.scaling_available, reason="Scaling not available"
+    )
+    def test_draft(self):
+        with Image.open(TEST_AVIF_FILE) as im:
+            assert im.draft(None, (40, 40)) == ("RGB", (0, 0, 128 / 3, 128 / 3))
+            assert im.size == (43, 43)
+            im.load()
+            assert len(im.tobytes()) == 43 * 43 * 3
+
+        with Image.open(TEST_AVIF_FILE) as im:
+            assert im.draft("RGB", (32, 32)) == ("RGB", (0, 0, 32.0, 32.0))
+            assert im.size == (32, 32)
+            assert im.draft("RGB", (128, 128)) == ("RGB", (0, 0, 128.0, 128.0))
+            assert im.size == (128, 128)
+            im.load()
+            assert im.draft(None, (32, 32)) is None
+        assert_image_similar_tofile(
+            im, "%s/tests/images/hopper_avif_write.png" % CURR_DIR, 12.0
+        )
+
+    @pytest.mark.skipif(
+        not _avif or not _avif.scaling_available, reason="Scaling not available"
+    )
+    def test_draft_seek(self):
+        with Image.open("tests/images/star.avifs") as im:
+            im.seek(1)
+            expected = im.copy()
+
+        with Image.open("tests/images/star.avifs") as im:
+            width, height = im.size
+            im.draft(None, (width // 2, height // 2))
+            size = im.size
+            assert size == ((width + 1) // 2, (height + 1) // 2)
+            im.load()
+
+            im.seek(1)
+            assert im.size == size
+            im.load()
+            assert im.im.size == size
+            assert_image_similar(im, expected.resize(size), 12.0)
+
+            im.seek(0)
+            assert im.size == size
+
+    @pytest.mark.skipif(
+        not _avif or not _avif.scaling_available, reason="Scaling not available"
+    )
+    def test_thumbnail_draft(self):
+        with Image.open(TEST_AVIF_FILE) as im:
+            im.thumbnail((32, 32))
+            assert im.size == (32, 32)
+            with Image.open(
+                "%s/tests/images/hopper_avif_write.png" % CURR_DIR
+            ) as expected:
+                assert_image_similar(im, expected.resize((32, 32)), 12.0)
+
+    def test_embedded_thumbnail(self, tmp_path):
+        test_file = str(tmp_path / "temp.avif")
+        hopper().save(test_file, thumbnail=(32, 32))
+        with Image.open(test_file) as im:
+            assert im.get_thumbnails() == [(32, 32)]
+            thumbnail = im.load_thumbnail()
+            assert_image(thumbnail, "RGB", (32, 32))
+            assert_image_similar(thumbnail, hopper().resize((32, 32)), 12.0)
+
+            # The full size image is still the primary item
+            assert im.size == (128, 128)
+            assert_image_similar(im, hopper(), 12.0)
+
+    def test_embedded_thumbnail_alpha(self, tmp_path):
+        test_file = str(tmp_path / "temp.avif")
+        im = hopper("RGBA")
+        im.putalpha(128)
+        im.save(test_file, thumbnail=(64, 64))
+        with Image.open(test_file) as reloaded:
+            thumbnail = reloaded.load_thumbnail((16, 16))
+            assert_image(thumbnail, "RGBA", (64, 64))
+            assert thumbnail.getextrema()[3] == (128, 128)
+
+    def test_embedded_thumbnail_orientation(self, tmp_path):
+        test_file = str(tmp_path / "temp.avif")
+        exif = Image.Exif()
+        exif[274] = 6
+        hopper().save(test_file, exif=exif, thumbnail=(32, 32))
+        with Image.open(test_file) as im:
+            assert im.getexif()[274] == 6
+            assert im.load_thumbnail().getexif()[274] == 6
+
+    def test_embedded_thumbnail_from_file_object(self):
+        out = BytesIO()
+        hopper().save(out, "AVIF", thumbnail=(32, 32))
+        out.seek(0)
+        with Image.open(out) as im:
+            im.load()
+            assert_image(im.load_thumbnail(), "RGB", (32, 32))
+
+    def test_no_embedded_thumbnail(self):
+        with Image.open(TEST_AVIF_FILE) as im:
+            assert im.get_thumbnails() == []
+            assert im.load_thumbnail() is None
+
+    def _write_grid(self, tmp_path):
+        # A 2x2 grid of hopper tiles, with the last row and column cut short
+        with open(TEST_AVIF_FILE, "rb") as f:
+            data = f.read()
+        reader = _isobmff.Reader(data)
+        boxes = _isobmff.read_top_level_boxes(reader, (b"meta",))
+        items = _isobmff.ItemProperties(boxes[b"meta"])
+        tile_ids = [items.primary_id] * 4
+        test_file = str(tmp_path / "grid.avif")
+        with open(test_file, "wb") as f:
+            f.write(
+                _isobmff.build_grid_file(
+                    reader, items, [(items.primary_id, tile_ids)], 2, (200, 180)
+                )
+            )
+        return test_file
+
+    @pytest.mark.parametrize("upsampling", ["auto", "nearest"])
+    @pytest.mark.parametrize(
+        "box",
+        [
+            (10, 20, 50, 60),
+            (100, 100, 200, 180),
+            (130, 10, 190, 170),
+            (128, 0, 200, 128),
+            (0, 0, 128, 128),
+        ],
+    )
+    def test_decode_region(self, tmp_path, monkeypatch, upsampling, box):
+        monkeypatch.setattr(AvifImagePlugin, "CHROMA_UPSAMPLING", upsampling)
+        test_file = self._write_grid(tmp_path)
+        with Image.open(test_file) as im:
+            assert im.size == (200, 180)
+            expected = im.copy().crop(box)
+
+        with Image.open(test_file) as im:
+            region = im.decode_region(box)
+            assert im.tile
+        assert_image(region, "RGB", (box[2] - box[0], box[3] - box[1]))
+        assert region.tobytes() == expected.tobytes()
+
+        with Image.open(test_file) as im:
+            assert im.crop(box).tobytes() == expected.tobytes()
+
+    def test_decode_region_not_grid(self):
+        with Image.open(TEST_AVIF_FILE) as im:
+            region = im.decode_region((10, 20, 50, 60))
+            assert_image(region, "RGB", (40, 40))
+            assert not im.tile
+
+    def test_get_yuv_frame(self):
+        with open(TEST_AVIF_FILE, "rb") as f:
+            decoder = _avif.AvifDecoder(f.read(), "auto", "auto", 0)
+        assert decoder.get_yuv_info() == (8, "4:2:0", "full", 6, False)
+
+        planes, strides, timescale, pts, duration = decoder.get_yuv_frame(0)
+        assert strides == (128, 64, 64, None)
+        assert [len(plane) if plane else None for plane in planes] == [
+            128 * 128,
+            64 * 64,
+            64 * 64,
+            None,
+        ]
+        with Image.open(TEST_AVIF_FILE) as im:
+            luma = Image.frombuffer("L", (128, 128), planes[0], "raw", "L", 0, 1)
+            assert_image_similar(luma, im.convert("YCbCr").getchannel(0), 2)
+
+    def test_draft_ycbcr(self):
+        im = hopper()
+        out = BytesIO()
+        im.save(out, "AVIF", subsampling="4:4:4", range="full")
+
+        with Image.open(out) as reloaded:
+            reloaded.draft("YCbCr", None)
+            assert reloaded.mode == "YCbCr"
+            reloaded.load()
+            assert reloaded.im.mode == "YCbCr"
+            assert_image_similar(reloaded.convert("RGB"), im, 6)
+
+        # Subsampled images are still converted to RGB
+        with Image.open(TEST_AVIF_FILE) as im:
+            im.draft("YCbCr", None)
+            assert im.mode == "RGB"
+
     def test_background_from_gif(self, tmp_path):
         with Image.open("%s/tests/images/chi.gif" % CURR_DIR) as im:
             original_value = im.convert("RGB").getpixel((1, 1))
@@ -242,6 +536,19 @@ class TestFileAvif:
         with pytest.raises(SyntaxError):
             AvifImagePlugin.AvifImageFile(invalid_file)
 
+    @pytest.mark.skipif(sys.version_info < (3,), reason="requires Python 3")
+    def test_encoder_finish_buffer(self):
+        im = hopper("RGBA")
+        data = self._encode_rgba(im.tobytes(), im.size)
+        enc = _avif.AvifEncoder(*self._encoder_args(im.size))
+        enc.add(im.tobytes(), 0, im.width, im.height, "RGBA", True)
+        output = enc.finish()
+        assert not isinstance(output, bytes)
+        assert len(output) == len(data)
+        view = memoryview(output)
+        assert view.readonly
+        assert view.tobytes() == data
+
     def test_load_transparent_rgb(self):
         test_file = "tests/images/transparency.avif"
         with Image.open(test_file) as im:
@@ -250,6 +557,82 @@ class TestFileAvif:
             # image has 876 transparent pixels
             assert im.getchannel("A").getcolors()[0][0] == 876
 
+    def test_load_transparent_rgb_writable(self):
+        with Image.open("tests/images/transparency.avif") as im:
+            px = im.load()
+            px[0, 0] = (1, 2, 3, 4)
+            assert im.getpixel((0, 0)) == (1, 2, 3, 4)
+
+    def test_get_frame_buffer(self):
+        with open(TEST_AVIF_FILE, "rb") as f:
+            decoder = _avif.AvifDecoder(f.read(), "auto", "auto", 0)
+        data = decoder.get_frame(0)[0]
+        assert isinstance(data, bytearray)
+        assert len(data) == 128 * 128 * 3
+
+    def _encoder_args(self, size):
+        return (
+            size[0],
+            size[1],
+            "4:2:0",
+            -1,
+            -1,
+            75,
+            8,
+            0,
+            "auto",
+            "full",
+            0,
+            0,
+            False,
+            False,
+            b"",
+            b"",
+            0,
+            b"",
+            None,
+        )
+
+    def _encode_rgba(self, pixels, size, *row_bytes):
+        enc = _avif.AvifEncoder(*self._encoder_args(size))
+        enc.add(pixels, 0, size[0], size[1], "RGBA", True, *row_bytes)
+        return bytes(enc.finish())
+
+    @pytest.mark.parametrize("buffer_type", (bytearray, memoryview))
+    def test_encoder_add_buffer(self, buffer_type):
+        im = hopper("RGBA")
+        data = im.tobytes()
+        expected = self._encode_rgba(data, im.size)
+        assert self._encode_rgba(buffer_type(data), im.size) == expected
+
+    def test_encoder_add_row_bytes(self):
+        im = hopper("RGBA")
+        data = im.tobytes()
+        stride = im.width * 4
+        padded = b"".join(
+            data[y * stride : (y + 1) * stride] + b"\0" * 16 for y in range(im.height)
+        )
+        expected = self._encode_rgba(data, im.size)
+        assert self._encode_rgba(padded, im.size, stride + 16) == expected
+
+    def test_encoder_add_invalid_buffer(self):
+        im = hopper("RGBA")
+        data = im.tobytes()
+        with pytest.raises(RuntimeError):
+            self._encode_rgba(data[:-1], im.size)
+        with pytest.raises(ValueError):
+            self._encode_rgba(data, im.size, im.width * 4 - 1)
+
+    def test_save_decoded_rgba(self):
+        with Image.open("tests/images/transparency.avif") as im:
+            im.load()
+            assert im._mapped_pixels() is not None
+            out = BytesIO()
+            im.save(out, "AVIF")
+            expected = BytesIO()
+            Image.frombytes(im.mode, im.size, im.tobytes()).save(expected, "AVIF")
+        assert out.getvalue() == expected.getvalue()
+
     def test_save_transparent(self, tmp_path):
         im = Image.new("RGBA", (10, 10), (0, 0, 0, 0))
         assert im.getcolors() == [(100, (0, 0, 0, 0))]
@@ -340,6 +723,34 @@ class TestFileAvif:
             xmp = im.info.get("xmp")
         assert_xmp_orientation(xmp, 3)
 
+    @pytest.mark.parametrize(
+        "option, test_file, key",
+        [
+            ("IGNORE_EXIF", "exif.avif", "exif"),
+            ("IGNORE_XMP", "xmp_tags_orientation.avif", "xmp"),
+            ("IGNORE_ICC", "icc_profile.avif", "icc_profile"),
+        ],
+    )
+    def test_ignore_metadata(self, monkeypatch, option, test_file, key):
+        test_file = "tests/images/" + test_file
+        with Image.open(test_file) as im:
+            assert key in im.info
+
+        monkeypatch.setattr(AvifImagePlugin, option, True)
+        with Image.open(test_file) as im:
+            assert key not in im.info
+            im.load()
+
+    def test_ignore_alpha(self, monkeypatch):
+        with Image.open("tests/images/transparency.avif") as im:
+            expected = im.convert("RGB")
+
+        monkeypatch.setattr(AvifImagePlugin, "IGNORE_ALPHA", True)
+        with Image.open("tests/images/transparency.avif") as im:
+            assert im.mode == "RGB"
+            im.load()
+            assert_image_similar(im, expected, 1)
+
     def test_xmp_save(self, tmp_path):
         with Image.open("tests/images/xmp_tags_orientation.avif") as im:
             test_file = str(tmp_path / "temp.avif")
@@ -397,6 +808,65 @@ class TestFileAvif:
             test_file = str(tmp_path / "temp.avif")
             im.save(test_file, subsampling=subsampling)
 
+    @pytest.mark.parametrize("yuv_range", ["full", "limited"])
+    def test_grayscale(self, yuv_range):
+        im = hopper("L")
+        out = BytesIO()
+        im.save(out, "AVIF", subsampling="4:0:0", range=yuv_range)
+
+        with Image.open(out) as reloaded:
+            assert reloaded.mode == "L"
+            assert_image_similar(reloaded, im, 4)
+
+    def test_grayscale_alpha(self):
+        im = hopper("LA")
+        out = BytesIO()
+        im.save(out, "AVIF", subsampling="4:0:0")
+
+        with Image.open(out) as reloaded:
+            assert reloaded.mode == "LA"
+            assert_image_similar(reloaded, im, 4)
+
+    def test_grayscale_16bit(self):
+        out = BytesIO()
+        hopper("L").save(out, "AVIF", subsampling="4:0:0", range="full")
+
+        with Image.open(out) as im:
+            expected = im.copy()
+        with Image.open(out) as im:
+            im.draft("I;16", None)
+            assert im.mode == "I;16"
+            im.load()
+            for xy in [(0, 0), (50, 60), (127, 127)]:
+                assert im.getpixel(xy) == expected.getpixel(xy) * 257
+
+    def test_get_frame_16bit(self):
+        with Image.open(TEST_AVIF_FILE) as im:
+            mode, size, data = im.get_frame_16bit()
+            expected = im.tobytes()
+        assert mode == "RGB"
+        assert size == (128, 128)
+        assert len(data) == 128 * 128 * 3 * 2
+
+        samples = array.array("H", bytes(data))
+        if sys.byteorder == "big":
+            samples.byteswap()
+        assert max(
+            abs((sample + 128) // 257 - value)
+            for sample, value in zip(samples, bytearray(expected))
+        ) <= 1
+
+    @pytest.mark.skipif(
+        not _avif or not _avif.scaling_available, reason="Scaling not available"
+    )
+    def test_get_frame_16bit_draft(self):
+        with Image.open(TEST_AVIF_FILE) as im:
+            im.draft(None, (64, 64))
+            mode, size, data = im.get_frame_16bit()
+        assert mode == "RGB"
+        assert size == (64, 64)
+        assert len(data) == 64 * 64 * 3 * 2
+
     def test_encoder_subsampling_invalid(self, tmp_path):
         with Image.open(TEST_AVIF_FILE) as im:
             test_file = str(tmp_path / "temp.avif")
@@ -414,6 +884,31 @@ class TestFileAvif:
             with pytest.raises(ValueError):
                 im.save(test_file, range="foo")
 
+    def test_encoder_session(self):
+        session = pillow_avif.EncoderSession(quality=90, speed=8)
+        for im in (hopper(), hopper("RGBA"), hopper("L")):
+            data = session.encode(im)
+            assert isinstance(data, bytes)
+            expected = BytesIO()
+            im.save(expected, "AVIF", quality=90, speed=8)
+            assert data == expected.getvalue()
+
+    def test_encoder_session_save_all(self):
+        session = pillow_avif.EncoderSession(save_all=True, duration=100)
+        with Image.open("tests/images/star.avifs") as im:
+            data = session.encode(im)
+        with Image.open(BytesIO(data)) as im:
+            assert im.n_frames == 5
+            assert im.info["duration"] == 100
+
+    def test_encoder_session_invalid_options(self):
+        with pytest.raises(ValueError):
+            pillow_avif.EncoderSession(quality=101)
+        with pytest.raises(ValueError):
+            pillow_avif.EncoderSession(codec="foo")
+        with pytest.raises(ValueError):
+            pillow_avif.EncoderSession(advanced=1)
+
     @skip_unless_avif_encoder("aom")
     def test_encoder_codec_param(self, tmp_path):
         with Image.open(TEST_AVIF_FILE) as im:
@@ -584,6 +1079,54 @@ class TestFileAvif:
         with Image.open("%s/tests/images/chimera-missing-pixi.avif" % CURR_DIR) as im:
             assert im.size == (480, 270)
 
+    @skip_unless_avif_version_gte((0, 9, 3))
+    def test_decoder_image_size_limit(self, monkeypatch):
+        monkeypatch.setattr(AvifImagePlugin, "DECODE_IMAGE_SIZE_LIMIT", 128 * 128 - 1)
+        with pytest.raises((OSError, RuntimeError)):
+            Image.open(TEST_AVIF_FILE)
+
+        monkeypatch.setattr(AvifImagePlugin, "DECODE_IMAGE_SIZE_LIMIT", 128 * 128)
+        with Image.open(TEST_AVIF_FILE) as im:
+            im.load()
+
+    def test_decoder_image_size_limit_default(self, monkeypatch):
+        # Over twice the pixels of a decompression bomb warning
+        monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 128 * 64 - 1)
+        assert AvifImagePlugin._decoder_limits()[0] == 0
+        with pytest.raises(Image.DecompressionBombError):
+            Image.open(TEST_AVIF_FILE)
+
+    @skip_unless_avif_version_gte((1, 0, 0))
+    def test_decoder_image_dimension_limit(self, monkeypatch):
+        monkeypatch.setattr(AvifImagePlugin, "DECODE_IMAGE_DIMENSION_LIMIT", 127)
+        with pytest.raises((OSError, RuntimeError)):
+            Image.open(TEST_AVIF_FILE)
+
+    @skip_unless_avif_version_gte((0, 9, 3))
+    def test_decoder_image_count_limit(self):
+        with open("tests/images/star.avifs", "rb") as f:
+            data = f.read()
+        args = (data, "auto", "auto", 0, False, False, False, False, "tracks", 0, 0)
+        with pytest.raises((SyntaxError, RuntimeError)):
+            _avif.AvifDecoder(*(args + (4,)))
+        assert _avif.AvifDecoder(*(args + (5,))).get_info()[2] == 5
+
+    def test_decode_many_decompression_bomb(self, monkeypatch):
+        monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 128 * 64 - 1)
+        (result,) = pillow_avif.decode_many([TEST_AVIF_FILE])
+        if _avif.VERSION >= (0, 9, 3):
+            assert isinstance(result, Exception)
+        else:
+            assert result.size == (128, 128)
+
+    def test_decode_many_limits(self, monkeypatch):
+        monkeypatch.setattr(AvifImagePlugin, "DECODE_IMAGE_SIZE_LIMIT", 128 * 128 - 1)
+        (result,) = pillow_avif.decode_many([TEST_AVIF_FILE])
+        if _avif.VERSION >= (0, 9, 3):
+            assert isinstance(result, Exception)
+        else:
+            assert result.size == (128, 128)
+
     @skip_unless_avif_encoder("aom")
     def test_aom_optimizations(self):
         im = hopper("RGB")
@@ -690,6 +1233,100 @@ class TestAvifAnimation:
         with pytest.raises(ValueError):
             frame1.save(temp_file, save_all=True, append_images=[frame2], duration=100)
 
+    def test_pipeline(self):
+        def encode(**options):
+            out = BytesIO()
+            with Image.open("tests/images/star.avifs") as im:
+                im.save(out, "AVIF", save_all=True, **options)
+            return out.getvalue()
+
+        assert encode(pipeline=True) == encode(pipeline=False)
+
+    def test_pipeline_add_error(self):
+        frames = [Image.new("RGB", (100, 100), color) for color in ("red", "blue")]
+        enc = _avif.AvifEncoder(
+            100,
+            100,
+            "4:2:0",
+            -1,
+            -1,
+            75,
+            8,
+            0,
+            "auto",
+            "full",
+            0,
+            0,
+            False,
+            False,
+            b"",
+            b"",
+            0,
+            b"",
+            None,
+            True,
+        )
+        enc.add(frames[0].tobytes(), 100, 100, 100, "RGB", False)
+        with pytest.raises(ValueError):
+            enc.add(b"", 100, 150, 150, "RGB", False)
+        enc.add(frames[1].tobytes(), 100, 100, 100, "RGB", False)
+        with Image.open(BytesIO(enc.finish())) as im:
+            assert im.n_frames == 2
+
+    def test_writer(self):
+        out = BytesIO()
+        with Image.open("tests/images/star.avifs") as im:
+            with pillow_avif.AvifWriter(out, quality=90) as writer:
+                for i in range(im.n_frames):
+                    im.seek(i)
+                    writer.add_frame(im, 100)
+            assert writer.n_frames == 5
+
+            expected = BytesIO()
+            im.save(expected, "AVIF", save_all=True, quality=90, duration=100)
+        assert out.getvalue() == expected.getvalue()
+
+    def test_writer_buffers(self, tmp_path):
+        temp_file = str(tmp_path / "temp.avif")
+        colors = ((255, 0, 0), (0, 0, 255), (0, 255, 0))
+        pixels = bytearray(100 * 100 * 3)
+        writer = pillow_avif.AvifWriter(temp_file, duration=[100, 200, 300])
+        for i, color in enumerate(colors):
+            # The same buffer is reused for each frame
+            pixels[:] = Image.new("RGB", (100, 100), color).tobytes()
+            writer.add_frame(pixels, size=(100, 100) if i == 0 else None, mode="RGB")
+        writer.close()
+
+        with Image.open(temp_file) as im:
+            assert im.n_frames == 3
+            for i, color in enumerate(colors):
+                im.seek(i)
+                assert im.info["duration"] == 100 * (i + 1)
+                expected = Image.new("RGB", (100, 100), color)
+                assert_image_similar(im, expected, 1)
+
+    def test_writer_single_frame(self):
+        out = BytesIO()
+        with pillow_avif.AvifWriter(out) as writer:
+            writer.add_frame(hopper())
+
+        expected = BytesIO()
+        hopper().save(expected, "AVIF")
+        assert out.getvalue() == expected.getvalue()
+
+    def test_writer_errors(self, tmp_path):
+        temp_file = str(tmp_path / "temp.avif")
+        writer = pillow_avif.AvifWriter(temp_file)
+        with pytest.raises(ValueError):
+            writer.add_frame(b"\0" * 300, mode="RGB")
+        with pytest.raises(ValueError):
+            writer.add_frame(b"\0" * 400, size=(10, 10), mode="CMYK")
+        with pytest.raises(ValueError):
+            writer.close()
+        assert writer.fp is None
+        with pytest.raises(ValueError):
+            writer.add_frame(hopper())
+
     def test_heif_raises_unidentified_image_error(self):
         with pytest.raises(UnidentifiedImageError or IOError):
             with Image.open("tests/images/rgba10.heif"):
@@ -733,6 +1370,47 @@ class TestAvifAnimation:
                 assert im.info["timestamp"] == ts
                 ts += durations[frame]
 
+    @skip_unless_avif_version_gte((0, 9, 1))
+    def test_frame_timings(self, tmp_path):
+        durations = [1, 10, 20, 30, 40]
+        temp_file = str(tmp_path / "temp.avif")
+        with self.star_frames() as frames:
+            frames[0].save(
+                temp_file,
+                save_all=True,
+                append_images=(frames[1:] + [frames[0]]),
+                duration=durations,
+            )
+
+        with open(temp_file, "rb") as f:
+            decoder = _avif.AvifDecoder(f.read(), "auto", "auto", 0)
+        timescale, _, timings = decoder.get_timings()
+        assert [duration * 1000 // timescale for _, duration in timings] == durations
+
+        with Image.open(temp_file) as im:
+            # Available before any frame is loaded
+            assert im.info["duration"] == 1
+            assert im.info["timestamp"] == 0
+            timestamps = [0, 1, 11, 31, 61]
+            assert im.get_frame_timings() == list(zip(timestamps, durations))
+
+            im.seek(3)
+            assert im.info["duration"] == 30
+            assert im.info["timestamp"] == 31
+
+    @skip_unless_avif_version_gte((1, 0, 0))
+    def test_loop(self, tmp_path):
+        temp_file = str(tmp_path / "temp.avif")
+        with self.star_frames() as frames:
+            frames[0].save(temp_file, save_all=True, append_images=frames[1:])
+
+        # libavif writes sequences that repeat forever by default
+        with Image.open(temp_file) as im:
+            assert im.info["loop"] == 0
+
+        with Image.open(TEST_AVIF_FILE) as im:
+            assert "loop" not in im.info
+
     def test_seeking(self, tmp_path):
         """
         Create an animated AVIF file, and then try seeking through frames in
@@ -762,6 +1440,161 @@ class TestAvifAnimation:
                 assert im.info["timestamp"] == ts
                 ts -= dur
 
+    def test_decoder_iterator(self):
+        with open("tests/images/star.avifs", "rb") as f:
+            data = f.read()
+        decoder = _avif.AvifDecoder(data, "auto", "auto", 0)
+        frames = list(decoder)
+        assert len(frames) == 5
+
+        decoder = _avif.AvifDecoder(data, "auto", "auto", 0)
+        for i, frame in enumerate(frames):
+            assert decoder.get_frame(i) == frame
+
+        # Iteration continues after the last decoded frame
+        decoder.get_frame(2)
+        assert next(decoder) == frames[3]
+
+    def test_seek_sequential_and_random(self):
+        with Image.open("tests/images/star.avifs") as im:
+            frames = []
+            for frame in range(im.n_frames):
+                im.seek(frame)
+                frames.append(im.tobytes())
+
+            for frame in [3, 4, 0, 1, 4, 2, 3]:
+                im.seek(frame)
+                assert im.tobytes() == frames[frame]
+
+    def test_decoder_source(self):
+        with open("tests/images/star.avifs", "rb") as f:
+            data = f.read()
+        args = (data, "auto", "auto", 0, False, False, False, False)
+        assert _avif.AvifDecoder(*args + ("auto",)).get_info()[2] == 5
+        assert _avif.AvifDecoder(*args + ("tracks",)).get_info()[2] == 5
+        assert _avif.AvifDecoder(*args + ("primary",)).get_info()[2] == 1
+        with pytest.raises(ValueError):
+            _avif.AvifDecoder(*args + ("foo",))
+
+        decoder = _avif.AvifDecoder(data, "auto", "auto", 0)
+        assert decoder.set_source("primary") is True
+        assert decoder.get_info()[2] == 1
+        decoder.get_frame(0)
+        assert decoder.set_source("tracks") is True
+        assert decoder.get_info()[2] == 5
+        assert len(list(decoder)) == 5
+
+    def test_decoder_source_missing(self):
+        with open(TEST_AVIF_FILE, "rb") as f:
+            decoder = _avif.AvifDecoder(f.read(), "auto", "auto", 0)
+        assert decoder.set_source("tracks") is False
+        assert decoder.get_info()[2] == 1
+        decoder.get_frame(0)
+
+    def test_thumbnail_keeps_tracks(self):
+        with Image.open("tests/images/star.avifs") as im:
+            duration = im.info["duration"]
+            im.thumbnail((64, 64))
+            assert im.n_frames == 5
+            assert im.is_animated
+            assert im.info["duration"] == duration
+            im.seek(4)
+            im.load()
+
+    def test_thumbnail_uses_primary_item(self, monkeypatch):
+        monkeypatch.setattr(AvifImagePlugin, "DRAFT_PRIMARY_ITEM", True)
+        with Image.open("tests/images/star.avifs") as im:
+            assert im.n_frames == 5
+            im.thumbnail((64, 64))
+            assert im.n_frames == 1
+            assert not im.is_animated
+            assert im.size == (64, 64)
+            assert im.mode == "RGBA"
+            assert "loop" not in im.info
+
+    def test_thumbnail_source_tracks(self, monkeypatch):
+        monkeypatch.setattr(AvifImagePlugin, "DRAFT_PRIMARY_ITEM", True)
+        monkeypatch.setattr(AvifImagePlugin, "DECODE_SOURCE", "tracks")
+        with Image.open("tests/images/star.avifs") as im:
+            im.thumbnail((64, 64))
+            assert im.n_frames == 5
+
+    def test_embedded_thumbnail(self, tmp_path):
+        with Image.open("tests/images/star.avifs") as im:
+            test_file = str(tmp_path / "temp.avifs")
+            im.save(test_file, save_all=True, thumbnail=(64, 64))
+        with Image.open(test_file) as im:
+            assert im.n_frames == 5
+            assert im.get_thumbnails() == [(64, 64)]
+            assert_image(im.load_thumbnail(), "RGBA", (64, 64))
+            im.seek(4)
+            im.load()
+
+    def test_keyframes(self):
+        with open("tests/images/star.avifs", "rb") as f:
+            decoder = _avif.AvifDecoder(f.read(), "auto", "auto", 0)
+        n_frames = decoder.get_info()[2]
+
+        keyframes = decoder.get_keyframes()
+        assert keyframes[0] == 0
+        assert keyframes is decoder.get_keyframes()
+        for frame in range(n_frames):
+            assert decoder.is_keyframe(frame) == (frame in keyframes)
+            nearest = decoder.nearest_keyframe(frame)
+            assert nearest <= frame
+            assert nearest == max(k for k in keyframes if k <= frame)
+
+        with pytest.raises(IndexError):
+            decoder.is_keyframe(n_frames)
+        with pytest.raises(IndexError):
+            decoder.nearest_keyframe(n_frames)
+
+    def test_seek_nearest_keyframe(self):
+        with Image.open("tests/images/star.avifs") as im:
+            last_frame = im.n_frames - 1
+            keyframe = im.seek_nearest_keyframe(last_frame)
+            assert keyframe <= last_frame
+            assert im.tell() == keyframe
+            im.load()
+
+            with pytest.raises(EOFError):
+                im.seek_nearest_keyframe(im.n_frames)
+
+    def test_frame_cache(self, monkeypatch):
+        with Image.open("tests/images/star.avifs") as im:
+            frame_size = len(im.tobytes())
+            expected = []
+            for frame in range(im.n_frames):
+                im.seek(frame)
+                expected.append(im.tobytes())
+
+        monkeypatch.setattr(AvifImagePlugin, "FRAME_CACHE_SIZE", frame_size * 2)
+        with Image.open("tests/images/star.avifs") as im:
+            for frame in [0, 1, 0, 1, 2, 0]:
+                im.seek(frame)
+                assert im.tobytes() == expected[frame]
+                # Changing the image doesn't change the cached frame
+                im.putpixel((0, 0), (1, 2, 3, 4))
+            # Frame 0 is evicted by frame 2
+            assert im.frame_cache_info() == (2, 4, frame_size * 2, frame_size * 2)
+
+    def test_frame_cache_disabled(self):
+        with Image.open("tests/images/star.avifs") as im:
+            for frame in [0, 1, 0]:
+                im.seek(frame)
+                im.load()
+            assert im.frame_cache_info() == (0, 3, 0, 0)
+
+    def test_frame_cache_ycbcr(self):
+        planes = (b"\0" * 16, b"\0" * 16, b"\0" * 16)
+        cache = AvifImagePlugin._FrameCache(48 * 2)
+        for index in range(3):
+            cache.put(index, (planes, 1, index, 1))
+        assert cache.get(0) is None
+        assert cache.get(1) is not None
+        assert cache.get(2) is not None
+        assert cache.info().currsize == 48 * 2
+
     def test_seek_errors(self):
         with Image.open("tests/images/star.avifs") as im:
             with pytest.raises(EOFError):
@@ -771,6 +1604,164 @@ class TestAvifAnimation:
                 im.seek(42)
 
 
+class TestAvifThreads:
+    def _run_threads(self, target, count=4):
+        errors = []
+
+        def run():
+            try:
+                target()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+
+    def test_decode_in_threads(self):
+        with open("tests/images/star.avifs", "rb") as f:
+            data = f.read()
+        with Image.open(BytesIO(data)) as im:
+            im.seek(im.n_frames - 1)
+            expected = im.tobytes()
+
+        def decode():
+            for _ in range(5):
+                with Image.open(BytesIO(data)) as im:
+                    im.seek(im.n_frames - 1)
+                    assert im.tobytes() == expected
+
+        self._run_threads(decode)
+
+    def test_shared_decoder_in_threads(self):
+        with open("tests/images/star.avifs", "rb") as f:
+            decoder = _avif.AvifDecoder(f.read(), "auto", "auto", 1)
+        n_frames = decoder.get_info()[2]
+        expected = [decoder.get_frame(i)[0] for i in range(n_frames)]
+
+        def decode():
+            for i in list(range(n_frames)) + list(reversed(range(n_frames))):
+                assert decoder.get_frame(i)[0] == expected[i]
+
+        self._run_threads(decode)
+
+    def test_keyframes_in_threads(self):
+        with open("tests/images/star.avifs", "rb") as f:
+            decoder = _avif.AvifDecoder(f.read(), "auto", "auto", 1)
+        n_frames = decoder.get_info()[2]
+        keyframes = decoder.get_keyframes()
+
+        def decode():
+            for i in range(n_frames):
+                decoder.get_frame(i)
+                assert decoder.is_keyframe(i) == (i in keyframes)
+                assert decoder.nearest_keyframe(i) in keyframes
+                assert decoder.get_keyframes() == keyframes
+
+        self._run_threads(decode)
+
+    def test_decode_many(self, tmp_path):
+        with open("tests/images/hopper.avif", "rb") as f:
+            data = f.read()
+        invalid_file = str(tmp_path / "invalid.avif")
+        with open(invalid_file, "wb") as f:
+            f.write(data[:100])
+        sources = [
+            "tests/images/hopper.avif",
+            data,
+            BytesIO(data),
+            "tests/images/transparency.avif",
+            invalid_file,
+            str(tmp_path / "missing.avif"),
+            "tests/images/star.avifs",
+        ]
+        results = pillow_avif.decode_many(sources, max_workers=3)
+        assert len(results) == len(sources)
+
+        for result, source in zip(results[:4], sources):
+            if not isinstance(source, str):
+                source = BytesIO(data)
+            with Image.open(source) as expected:
+                assert_image(result, expected.mode, expected.size)
+                assert result.tobytes() == expected.tobytes()
+        assert isinstance(results[4], SyntaxError)
+        assert isinstance(results[5], (OSError, IOError))
+        assert_image(results[6], "RGBA", (159, 159))
+
+    def test_decode_many_closes_maps(self, monkeypatch):
+        maps = []
+        close_mmap = AvifImagePlugin._close_mmap
+
+        def record(data):
+            maps.append(data.obj if isinstance(data, memoryview) else data)
+            close_mmap(data)
+
+        monkeypatch.setattr(AvifImagePlugin, "_close_mmap", record)
+        with open("tests/images/star.avifs", "rb") as f:
+            results = pillow_avif.decode_many([TEST_AVIF_FILE, f])
+        assert [result.size for result in results] == [(128, 128), (159, 159)]
+        assert len(maps) == (0 if sys.version_info[0] == 2 else 2)
+        assert all(mapped.closed for mapped in maps)
+
+    def test_decode_many_empty(self):
+        assert pillow_avif.decode_many([]) == []
+
+    def test_decode_many_invalid_source(self):
+        with pytest.raises(TypeError):
+            _avif.decode_many([None], "auto", "auto", 1, 1)
+
+
+class TestAvifProbe:
+    @pytest.mark.parametrize(
+        "test_file, expected",
+        [
+            ("hopper.avif", (128, 128, 1, False, 8, "4:2:0")),
+            ("transparency.avif", (64, 64, 1, True, 8, "4:4:4")),
+            ("chimera-missing-pixi.avif", (480, 270, 1, False, 10, "4:2:0")),
+            ("star.avifs", (159, 159, 5, True, 8, "4:2:0")),
+        ],
+    )
+    def test_probe(self, test_file, expected):
+        test_file = "tests/images/" + test_file
+        assert pillow_avif.probe(test_file) == expected
+
+        with Image.open(test_file) as im:
+            width, height, n_frames, has_alpha = expected[:4]
+            assert im.size == (width, height)
+            assert im.n_frames == n_frames
+            assert ("A" in im.mode) == has_alpha
+
+    def test_probe_sources(self):
+        with open("tests/images/star.avifs", "rb") as f:
+            data = f.read()
+            f.seek(0)
+            from_file = pillow_avif.probe(f)
+        assert pillow_avif.probe(data) == from_file
+        assert pillow_avif.probe(bytearray(data)) == from_file
+        assert pillow_avif.probe(memoryview(data)) == from_file
+        assert pillow_avif.probe(BytesIO(data)) == from_file
+
+    def test_probe_invalid(self):
+        with pytest.raises(SyntaxError):
+            pillow_avif.probe("tests/images/flower.jpg")
+        with open(TEST_AVIF_FILE, "rb") as f:
+            data = f.read()
+        with pytest.raises(SyntaxError):
+            pillow_avif.probe(data[:200])
+
+    def test_probe_many(self, tmp_path):
+        missing = str(tmp_path / "missing.avif")
+        results = pillow_avif.probe_many(
+            [TEST_AVIF_FILE, "tests/images/flower.jpg", missing]
+        )
+        assert results[0] == pillow_avif.probe(TEST_AVIF_FILE)
+        assert isinstance(results[1], SyntaxError)
+        assert isinstance(results[2], (OSError, IOError))
+
+
 if hasattr(os, "sched_getaffinity"):
     MAX_THREADS = len(os.sched_getaffinity(0))
 else: